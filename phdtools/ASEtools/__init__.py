@@ -1 +1,4 @@
 from .asetools import *
+from .lazytraj import *
+from .trajstore import *
+from .scheduler import *
@@ -5,13 +5,17 @@
 # AUTHOR: Andrea Gardin
 # -------------------------------------------------- #
 
-# import os
-# import json
+import os
+import json
+import hashlib
 import numpy as np
 from tqdm import tqdm
-from typing import Union, List
+from typing import Union, List, Callable
 from ase.io import read, write
 from .atomstools import *
+from .lazytraj import LazyTraj, is_lazy_readable
+from .trajstore import TrajStore, write_traj_store
+from .scheduler import FrameScheduler
 from ..computes import misc, traj
 
 # -------------------------------------------------- #
@@ -34,6 +38,8 @@ class Universe:
         Optional kwargs are:
         - rcutCorrection: dict (Default=1.0)
         - moleculeNames: list (Default='molXXX')
+        - cache: bool (Default=True), reuse the topology (molecules,
+          molIDs, molSym) saved next to the trajectory, if still valid.
 
         :param projectName: Name of the project (aka the system).
         :type projectName: str
@@ -46,6 +52,8 @@ class Universe:
         self.trajPath = trajPath
         self.rcutCorrection = None
         self.moleculeNames = None
+        self._traj = None
+        self._conMat = None
         # --- init the project
         # -
         self._get_config
@@ -68,8 +76,14 @@ class Universe:
         except:
             print("!!! Warning: `moleculeNames` not set !!!\n"
                   "Default molecules names will be used\n")
-        self.find_molecs(mol_name=self.moleculeNames)
-        self.get_mol_info
+        use_cache = kwargs.get('cache', True)
+        # key computed on the user inputs, before the molecules search
+        cachePath = self._cache_path
+        if not (use_cache and self._load_cache(cachePath)):
+            self.find_molecs(mol_name=self.moleculeNames)
+            self.get_mol_info
+            if use_cache:
+                self._save_cache(cachePath)
         # - Update the dictionary
         self.projectDictionary = dict(
             projectName = self.projectName,
@@ -82,6 +96,72 @@ class Universe:
         )
         # -
         print("<end>")
+
+    @property
+    def _cache_path(self) -> str:
+        """Path of the topology cache file, next to the trajectory and
+        keyed by the trajectory path, rcutCorrection and moleculeNames.
+        """
+        key = json.dumps(dict(trajPath=os.path.abspath(self.trajPath),
+                              rcutCorrection=self.rcutCorrection,
+                              moleculeNames=self.moleculeNames),
+                         sort_keys=True, default=str)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        folder, name = os.path.split(os.path.abspath(self.trajPath))
+        return os.path.join(folder, f'.{name}.{digest}.phduniverse.npz')
+
+    def _load_cache(self,
+                    cachePath: str) -> bool:
+        """Loads the topology from the cache file, if it exists and the
+        trajectory did not change (same size and mtime).
+
+        :param cachePath: path of the cache file.
+        :type cachePath: str
+        :return: True if the topology has been loaded.
+        :rtype: bool
+        """
+        stat = os.stat(self.trajPath)
+        try:
+            with np.load(cachePath) as npz:
+                if (npz['size'] != stat.st_size or 
+                    npz['mtime'] != stat.st_mtime_ns):
+                    print("Universe cache is stale, rebuilding ...\n")
+                    return False
+                topology = json.loads(str(npz['topology']))
+                self.molIDs = npz['molIDs']
+                self.molSym = npz['molSym'].tolist()
+        except (OSError, KeyError, ValueError):
+            return False
+        self.moleculeFormulas = topology['moleculeFormulas']
+        self.moleculeNames = topology['moleculeNames']
+        self._at0.arrays['molID'] = self.molIDs
+        print(f"Universe loaded from cache: {cachePath}\n"
+              f"Molecules found: {self.moleculeFormulas}\n"
+              f"Total numner of molecules: {len(self.molSym)}")
+        return True
+
+    def _save_cache(self,
+                    cachePath: str) -> None:
+        """Saves the topology (molecules, molIDs, molSym) to the cache file.
+
+        :param cachePath: path of the cache file.
+        :type cachePath: str
+        """
+        stat = os.stat(self.trajPath)
+        topology = json.dumps(dict(moleculeFormulas=self.moleculeFormulas,
+                                   moleculeNames=self.moleculeNames),
+                              default=str)
+        try:
+            with open(cachePath, 'wb') as f:
+                np.savez(f,
+                         size=stat.st_size,
+                         mtime=stat.st_mtime_ns,
+                         topology=topology,
+                         molIDs=np.asarray(self.molIDs),
+                         molSym=np.asarray(self.molSym))
+        except OSError as error:
+            print(f"!!! Warning: Universe cache not saved ({error})")
+        pass
             
     @property
     def _get_config(self):
@@ -90,13 +170,34 @@ class Universe:
         effectively building the Universe.
         """
         print("Gathering the Universe ...\n")
-        self._at0 = read(filename=self.trajPath, index='0')
+        if is_lazy_readable(self.trajPath):
+            self._at0 = self.traj[0]
+        else:
+            self._at0 = read(filename=self.trajPath, index='0')
         self.symbols = np.unique(self._at0.symbols)
         print(f"Total atoms: {len(self._at0.symbols)}\n"
               f"Atom types: {self.symbols}\n"
               )
         pass
 
+    @property
+    def traj(self) -> Union[LazyTraj, List[ase.ase.Atoms]]:
+        """Whole trajectory of the project.
+        (ext)xyz files are opened lazily, indexing the frames only once,
+        other formats are read with ase (once, then kept in memory).
+
+        :return: lazy trajectory or ase atoms database of frames.
+        :rtype: Union[LazyTraj, List[ase.ase.Atoms]]
+        """
+        if self._traj is None:
+            if is_lazy_readable(self.trajPath):
+                print("Indexing traj frames ...")
+                self._traj = LazyTraj(self.trajPath)
+            else:
+                print("Reading traj frames ...")
+                self._traj = read(self.trajPath, index=':')
+        return self._traj
+
 
     def set_rcut_correction(self, 
                             rcut_dict: dict) -> dict:
@@ -111,10 +212,24 @@ class Universe:
         """
         if set(rcut_dict.keys()) == set(self.symbols):
             self.rcutCorrection = rcut_dict
+            self._conMat = None
             return print(f"Updated rcutCorrection = {self.rcutCorrection}\n")
         else:
             raise ValueError("Given atom types does not match with the system types.\n")
 
+    @property
+    def connectivity(self) -> sparse.spmatrix:
+        """Sparse connectivity matrix of the first frame, computed once
+        (for the current rcutCorrection) and shared by the molecules tools.
+
+        :return: sparse connectivity matrix, (N, N).
+        :rtype: sparse.spmatrix
+        """
+        if self._conMat is None:
+            self._conMat = get_connectivity_matrix(at=self._at0,
+                                                   fct=self.rcutCorrection)
+        return self._conMat
+
     @misc.my_timer
     def find_molecs(self, 
                     mol_name: list = None) -> None:
@@ -125,7 +240,8 @@ class Universe:
         :type mol_name: list
         """
         self.moleculeFormulas = get_chemFormulas(self._at0, 
-                                                 fct=self.rcutCorrection)
+                                                 fct=self.rcutCorrection,
+                                                 conMat=self.connectivity)
         self.moleculeNames = list(self.moleculeFormulas.values())
         print(f"Uniques molecules found: {len(self.moleculeFormulas)}")
         if mol_name:
@@ -164,7 +280,8 @@ class Universe:
         # ---
         print("Computing MolIDs ...")
         self.molIDs = get_molIDs(at=self._at0,
-                                 fct=self.rcutCorrection)
+                                 fct=self.rcutCorrection,
+                                 conMat=self.connectivity)
         # ---
         print("Computing MolSymbols ...")
         self.molSym = get_molSym(at=self._at0,
@@ -231,19 +348,27 @@ class ASEtraj(Universe):
     @misc.my_timer
     def read(self, 
              frameRange: Union[tuple, list] = None,
-             Zshift: Tuple[str, list] = None,
+             Zshift: Union[Tuple[str, list], List[Tuple[str, list]]] = None,
              COM: bool = False,
-             save_to_file: str = None) -> List[ase.ase.Atoms]:
+             COMpbc: str = None,
+             n_workers: int = None,
+             save_to_file: str = None) -> Union[LazyTraj, List[ase.ase.Atoms]]:
         """Read the selected number of the trajectory provided in the project.
 
         :param frameRange: frame range , defaults to None
         :type frameRange: Union[tuple, list], optional
-        :param Zshift: Z numbers shift for atoms of a single molecule, defaults to None
-        :type Zshift: Tuple[str, list], optional
+        :param Zshift: Z numbers shift rule(s), (molecule, Z list), defaults to None
+        :type Zshift: Union[Tuple[str, list], List[Tuple[str, list]]], optional
+        :param COM: compute the molecules center of mass, defaults to False
+        :type COM: bool, optional
+        :param COMpbc: make the molecules whole before the COM, 'reference' or 'bonds', defaults to None
+        :type COMpbc: str, optional
+        :param n_workers: worker processes for the COM, defaults to None (serial)
+        :type n_workers: int, optional
         :param save_to_file: _description_, defaults to None
         :type save_to_file: str, optional
-        :return: Ase "database" of frame in list form.
-        :rtype: List[ase.ase.Atoms]
+        :return: Ase "database" of frame, lazy for (ext)xyz files.
+        :rtype: Union[LazyTraj, List[ase.ase.Atoms]]
         """
         if frameRange:
             self.frameRange = frameRange
@@ -252,7 +377,7 @@ class ASEtraj(Universe):
         # ---
         # traj reader
         if COM:
-            ase_db = self._readCOM
+            ase_db = self._readCOM(pbc=COMpbc, n_workers=n_workers)
         else:
             ase_db = self._read
             # zshift
@@ -261,8 +386,12 @@ class ASEtraj(Universe):
                                     molSymbols=self.molSym,
                                     molIDs=self.molIDs,
                                     to_shift=Zshift)
-                for snap in tqdm(ase_db, desc='Applying Z shift'):
-                    snap.numbers = newZ
+                if isinstance(ase_db, (LazyTraj, TrajStore)):
+                    # applied lazily when the frames are decoded
+                    ase_db = ase_db.with_numbers(newZ)
+                else:
+                    for snap in tqdm(ase_db, desc='Applying Z shift'):
+                        snap.numbers = newZ
         # # ---
         # # file saver
         # # may be not needed
@@ -271,12 +400,38 @@ class ASEtraj(Universe):
 
         return ase_db
 
+    @misc.my_timer
+    def to_store(self,
+                 storePath: str,
+                 frameRange: Union[tuple, list] = None,
+                 dtype: Union[str, np.dtype] = np.float32) -> TrajStore:
+        """Converts the selected frames into a memory-mapped columnar
+        store (positions, cells, numbers, masses and molIDs).
+
+        :param storePath: folder of the store.
+        :type storePath: str
+        :param frameRange: frame range, defaults to None
+        :type frameRange: Union[tuple, list], optional
+        :param dtype: positions dtype, defaults to np.float32
+        :type dtype: Union[str, np.dtype], optional
+        :return: memory-mapped trajectory.
+        :rtype: TrajStore
+        """
+        if frameRange:
+            self.frameRange = frameRange
+        write_traj_store(ase_db=self._read,
+                         storePath=storePath,
+                         molIDs=self.molIDs,
+                         dtype=dtype)
+        return TrajStore(storePath)
+
     @property
-    def _read(self) -> List[ase.ase.Atoms]:
+    def _read(self) -> Union[LazyTraj, List[ase.ase.Atoms]]:
         """Read a given trajectory using ase tools.
+        For (ext)xyz files the frames are decoded only when accessed.
 
         :return: ase atoms databese of frames.
-        :rtype: List[ase.ase.Atoms]
+        :rtype: Union[LazyTraj, List[ase.ase.Atoms]]
         """
         if isinstance(self._frameRange, tuple):
             # frame tuple complition
@@ -287,21 +442,150 @@ class ASEtraj(Universe):
                 b,e = self._frameRange
             print("Reading traj:\n"
                   f"Begin: {b} | End: {e} | Stride: {s}")
+            if is_lazy_readable(self.trajPath):
+                return self.traj[b:e:s]
             return read(self.trajPath, index=f'{b}:{e}:{s}')
         else:
-            return read(self.trajPath, index=f':')
+            return self.traj
         
-    @property
-    def _readCOM(self) -> List[ase.ase.Atoms]:
+    @misc.my_timer
+    def track_molecules(self,
+                        frameRange: Union[tuple, list] = None,
+                        verlet_skin: float = 1.0) -> Tuple[np.ndarray, list]:
+        """Identifies the molecules frame by frame (reactive trajectories),
+        instead of using the molIDs of the first frame.
+
+        :param frameRange: frame range, defaults to None
+        :type frameRange: Union[tuple, list], optional
+        :param verlet_skin: extra range of the reused candidate pairs, defaults to 1.0
+        :type verlet_skin: float, optional
+        :return: per-frame molecule IDs (T, N) and the bonds formation/breaking log.
+        :rtype: Tuple[np.ndarray, list]
+        """
+        if frameRange:
+            self.frameRange = frameRange
+        return track_molecules(ase_db=self._read,
+                               fct=self.rcutCorrection,
+                               verlet_skin=verlet_skin)
+
+    @misc.my_timer
+    def rdf(self,
+            sel_a: str,
+            sel_b: str = None,
+            r_max: float = 10.0,
+            bins: int = 200,
+            level: str = 'atom',
+            frameRange: Union[tuple, list] = None,
+            n_workers: int = None,
+            chunk_size: int = 100) -> dict:
+        """Radial distribution function between two species, streaming
+        the selected frames (in parallel with `n_workers`).
+
+        :param sel_a: first species, chemical symbol (atom level) or molecule symbol.
+        :type sel_a: str
+        :param sel_b: second species, defaults to None (same as sel_a)
+        :type sel_b: str, optional
+        :param r_max: largest distance, defaults to 10.0
+        :type r_max: float, optional
+        :param bins: number of bins, defaults to 200
+        :type bins: int, optional
+        :param level: 'atom' or 'molecule' (molecules COM), defaults to 'atom'
+        :type level: str, optional
+        :param frameRange: frame range, defaults to None
+        :type frameRange: Union[tuple, list], optional
+        :param n_workers: worker processes, defaults to None (serial)
+        :type n_workers: int, optional
+        :param chunk_size: frames per chunk, defaults to 100
+        :type chunk_size: int, optional
+        :raises NameError: if the level is not supported.
+        :raises ValueError: if the frame selection is empty.
+        :return: rdf dictionary, with `r`, `g` and `edges`.
+        :rtype: dict
+        """
+        if frameRange:
+            self.frameRange = frameRange
+        if level == 'atom':
+            labels = np.array(self._at0.get_chemical_symbols())
+            com_engine = None
+        elif level == 'molecule':
+            labels = np.array(self.molSym)
+            com_engine = MolecularCOM(masses=self._at0.get_masses(),
+                                      molIDs=self.molIDs,
+                                      pbc='reference')
+        else:
+            raise NameError(f"Unknown level '{level}'.\n"
+                            "Choose from: 'atom', 'molecule'.")
+        if not len(self._read):
+            raise ValueError(f"No frames in the frame range {self.frameRange}.")
+        sel_a_idxs = np.flatnonzero(labels == sel_a)
+        sel_b_idxs = None
+        if sel_b is not None and sel_b != sel_a:
+            sel_b_idxs = np.flatnonzero(labels == sel_b)
+        rdf_kwargs = dict(r_max=r_max, sel_a=sel_a_idxs, sel_b=sel_b_idxs,
+                          bins=bins, com_engine=com_engine)
+        if n_workers:
+            rdfs = self.map(rdf_accumulate, n_workers=n_workers,
+                            chunk_size=chunk_size, **rdf_kwargs)
+        else:
+            rdfs = [rdf_accumulate(self._read, chunk_size=chunk_size,
+                                   **rdf_kwargs)]
+        rdf = rdfs[0]
+        for other in rdfs[1:]:
+            rdf.merge(other)
+        return rdf.rdf_dict
+
+    def _readCOM(self,
+                 pbc: str = None,
+                 n_workers: int = None) -> List[ase.ase.Atoms]:
         """Compute the center of mass of a given ase trajectory using
         the molecule information of the project.
 
+        :param pbc: make the molecules whole, 'reference' or 'bonds', defaults to None
+        :type pbc: str, optional
+        :param n_workers: worker processes, defaults to None (serial)
+        :type n_workers: int, optional
         :return: ase atoms databese of frames.
         :rtype: List[ase.ase.Atoms]
         """
-        return center_of_mass(ase_db=self._read,
-                              molSymbols=self.molSym,
-                              molIDs=self.molIDs)
+        conMat = self.connectivity if pbc == 'bonds' else None
+        com_kwargs = dict(molSymbols=self.molSym,
+                          molIDs=self.molIDs,
+                          masses=self._at0.get_masses(),
+                          pbc=pbc,
+                          conMat=conMat)
+        if n_workers:
+            return self.map(center_of_mass, n_workers=n_workers, **com_kwargs)
+        return center_of_mass(ase_db=self._read, **com_kwargs)
+
+    @misc.my_timer
+    def map(self,
+            func: Callable,
+            per_frame: bool = False,
+            n_workers: int = None,
+            chunk_size: int = 100,
+            **kwargs) -> Union[np.ndarray, list]:
+        """Runs an analysis over the selected frames in parallel,
+        frame chunks are farmed out to a process pool and the results
+        reassembled in order (see `FrameScheduler`).
+        E.g., `map(find_molecules, per_frame=True, fct=...)` or
+        `map(QUIP(...).fit)` for the descriptors.
+
+        :param func: picklable analysis, on a chunk of frames (or on a frame).
+        :type func: Callable
+        :param per_frame: `func` takes a single frame, defaults to False
+        :type per_frame: bool, optional
+        :param n_workers: worker processes, defaults to None (all cores)
+        :type n_workers: int, optional
+        :param chunk_size: frames per chunk, defaults to 100
+        :type chunk_size: int, optional
+        :return: results in the frames order.
+        :rtype: Union[np.ndarray, list]
+        """
+        scheduler = FrameScheduler(n_workers=n_workers,
+                                   chunk_size=chunk_size)
+        if per_frame:
+            return scheduler.map_frames(func, self._read, **kwargs)
+        return scheduler.map_chunks(func, self._read, **kwargs)
 
             
         
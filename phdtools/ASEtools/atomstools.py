@@ -12,9 +12,14 @@ import numpy as np
 from tqdm import tqdm
 import ase
 from ase import Atoms, neighborlist
+from ase.symbols import Symbols
 from scipy import sparse
-from typing import Union, Tuple, List
+from scipy.spatial import cKDTree
+from itertools import islice, count
+from typing import Union, Tuple, List, Iterable, Iterator
 from ..computes import traj, misc
+from ..computes.rdf import RDF, wrap_box, minimum_image_box, wrap_positions, minimum_image
+from .trajstore import TrajStore
 
 # -------------------------------------------------- #
 # --- Atom tools
@@ -60,7 +65,8 @@ from ..computes import traj, misc
 
 @misc.my_timer
 def get_molIDs(at: ase.ase.Atoms, 
-               fct: Union[float, ase.ase.Atoms]) -> list:
+               fct: Union[float, ase.ase.Atoms],
+               conMat: sparse.spmatrix = None) -> list:
     """Computes the molecules IDs, a numerical index that differentiate
     each uniques molecule.
 
@@ -68,12 +74,15 @@ def get_molIDs(at: ase.ase.Atoms,
     :type at: ase.ase.Atoms
     :param fct: rcut correction, defaults to 1.0 (i.e., no correction)
     :type fct: Union[float, ase.ase.Atoms]
+    :param conMat: precomputed connectivity matrix, defaults to None
+    :type conMat: sparse.spmatrix, optional
     :return: list of indexes of the molecules of the atomic configuration.
     :rtype: list
     """
     # doc @ https://wiki.fysik.dtu.dk/ase/ase/neighborlist.html
     _, molID = get_connected_atoms(at=at, 
-                                   fct=fct)
+                                   fct=fct,
+                                   conMat=conMat)
     at.arrays['molID'] = molID
     return molID
 
@@ -92,16 +101,14 @@ def get_molSym(at: ase.ase.Atoms,
     :return: list of molecules of the atomic configuration.
     :rtype: list
     """
-    molSym = list()
-    for m in np.unique(molIDs):
-        mol = at[molIDs == m]
-        molSym.append(mol_name[mol.symbols.get_chemical_formula()])
+    molSym = [mol_name[f] for f in molecules_formulas(at.numbers, molIDs)]
     print(f"Total numner of molecules: {len(molSym)}")
     return molSym
 
 
 def get_chemFormulas(at: ase.ase.Atoms, 
-                     fct: Union[float, dict] = 1.0) -> dict:
+                     fct: Union[float, dict] = 1.0,
+                     conMat: sparse.spmatrix = None) -> dict:
     """Returns a dictionary with the whole molecules inside the
     system (dependent on the rcut correction, fct parameter).
 
@@ -109,20 +116,46 @@ def get_chemFormulas(at: ase.ase.Atoms,
     :type at: ase.ase.Atoms
     :param fct: rcut correction, defaults to 1.0 (i.e., no correction)
     :type fct: Union[float, dict], optional
+    :param conMat: precomputed connectivity matrix, defaults to None
+    :type conMat: sparse.spmatrix, optional
     :return: whole molecules dictionary.
     :rtype: dict
     """
-    _, molID = get_connected_atoms(at, fct)
-    chemFormulas_list = list()
-    for m in np.unique(molID):
-        mol = at[molID==m]
-        chemFormulas_list.append(mol.symbols.get_chemical_formula())
+    _, molID = get_connected_atoms(at, fct, conMat=conMat)
+    chemFormulas_list = molecules_formulas(at.numbers, molID)
     chemFormulas_dict = dict()
     for i,chem in enumerate(np.unique(chemFormulas_list)):
         chemFormulas_dict[chem] = f'mol{i+1}'
     return chemFormulas_dict
     
     
+def molecules_formulas(numbers: np.ndarray,
+                       molIDs: np.ndarray) -> np.ndarray:
+    """Chemical formula of each molecule, without slicing the atoms.
+    The molecules compositions are a single bincount over the
+    (molID, Z) pairs, the formulas are built once per distinct composition.
+
+    :param numbers: atomic numbers, (N,).
+    :type numbers: np.ndarray
+    :param molIDs: molecule ID of each atom, (N,).
+    :type molIDs: np.ndarray
+    :return: formulas of the molecules, in np.unique(molIDs) order, (M,).
+    :rtype: np.ndarray
+    """
+    _, mol_inv = np.unique(molIDs, return_inverse=True)
+    Zs, Z_inv = np.unique(numbers, return_inverse=True)
+    n_mols, n_Zs = mol_inv.max() + 1, len(Zs)
+    # composition histogram (M, nZ)
+    compositions = np.bincount(mol_inv * n_Zs + Z_inv,
+                               minlength=n_mols * n_Zs).reshape(n_mols, n_Zs)
+    unique_comps, comp_inv = np.unique(compositions, axis=0, return_inverse=True)
+    formulas = np.array([
+        Symbols(np.repeat(Zs, comp)).get_chemical_formula()
+        for comp in unique_comps
+    ])
+    return formulas[comp_inv.ravel()]
+    
+    
 # - computes molID for single config, not adding molID to atoms.arrays
 def find_molecules(at: ase.ase.Atoms, 
                    fct: Union[float, dict]):
@@ -142,7 +175,8 @@ def find_molecules(at: ase.ase.Atoms,
 
 
 def get_connected_atoms(at: ase.ase.Atoms, 
-                        fct: Union[float, dict]) -> Tuple[int, np.ndarray]:
+                        fct: Union[float, dict],
+                        conMat: sparse.spmatrix = None) -> Tuple[int, np.ndarray]:
     """Computes connected atoms based on the natural LJ cutoff range.
     Doc @ https://wiki.fysik.dtu.dk/ase/ase/neighborlist.html
 
@@ -150,19 +184,318 @@ def get_connected_atoms(at: ase.ase.Atoms,
     :type at: ase.ase.Atoms
     :param fct: scaling parameters for the LJ cutoffs.
     :type fct: Union[float, dict]
-    :return: _description_
+    :param conMat: precomputed connectivity matrix, defaults to None
+    :type conMat: sparse.spmatrix, optional
+    :return: number of molecules and molecule ID of each atom.
     :rtype: Tuple[int, np.ndarray]
     """
-    cutOff = modif_natural_cutoffs(at, fct)
-    nbLst = neighborlist.NeighborList(cutOff, 
-                                      self_interaction=False, 
-                                      bothways=True)
-    nbLst.update(at)
-    conMat = nbLst.get_connectivity_matrix(sparse=True)
+    if conMat is None:
+        conMat = get_connectivity_matrix(at, fct)
     Nmol, molID = sparse.csgraph.connected_components(conMat)
     return Nmol, molID
 
 
+def get_connectivity_matrix(at: ase.ase.Atoms, 
+                            fct: Union[float, dict],
+                            backend: str = 'kdtree',
+                            skin: float = 0.3) -> sparse.spmatrix:
+    """Computes the sparse (bonds) connectivity matrix based on the
+    natural LJ cutoff range: atoms i, j are bonded if their distance is
+    below (rc_i + skin) + (rc_j + skin), as in the ase NeighborList.
+    The 'kdtree' backend uses a periodic scipy cKDTree and falls back
+    to the ase NeighborList for triclinic or partially periodic cells.
+
+    :param at: ase atom configuration.
+    :type at: ase.ase.Atoms
+    :param fct: scaling parameters for the LJ cutoffs.
+    :type fct: Union[float, dict]
+    :param backend: 'kdtree' or 'ase', defaults to 'kdtree'
+    :type backend: str, optional
+    :param skin: skin added to each cutoff, defaults to 0.3 (ase default)
+    :type skin: float, optional
+    :raises NameError: if the backend is not supported.
+    :return: sparse connectivity matrix, (N, N).
+    :rtype: sparse.spmatrix
+    """
+    cutOff = modif_natural_cutoffs(at, fct)
+    if backend == 'kdtree':
+        radii = np.asarray(cutOff) + skin
+        box = None
+        if np.all(at.pbc):
+            cell = at.cell[:]
+            box = np.diagonal(cell)
+            orthorhombic = np.allclose(cell, np.diag(box))
+            # minimum image only: no multiple images of the same pair
+            if not orthorhombic or 2 * radii.max() >= box.min() / 2:
+                backend = 'ase'
+        elif np.any(at.pbc):
+            backend = 'ase'
+        if backend == 'kdtree':
+            return kdtree_connectivity(positions=at.positions,
+                                       radii=radii,
+                                       box=box)
+    if backend == 'ase':
+        nbLst = neighborlist.NeighborList(cutOff, 
+                                          skin=skin,
+                                          self_interaction=False, 
+                                          bothways=True)
+        nbLst.update(at)
+        return nbLst.get_connectivity_matrix(sparse=True)
+    raise NameError(f"Unknown backend '{backend}'.\n"
+                    "Choose from: 'kdtree', 'ase'.")
+
+
+def kdtree_connectivity(positions: np.ndarray,
+                        radii: np.ndarray,
+                        box: np.ndarray = None) -> sparse.csr_matrix:
+    """Connectivity matrix from a (periodic) KD-tree pairs search,
+    atoms i, j are bonded if their distance is below radii[i] + radii[j].
+
+    :param positions: atomic positions, (N, 3).
+    :type positions: np.ndarray
+    :param radii: per atom bonding radii, (N,).
+    :type radii: np.ndarray
+    :param box: orthorhombic box lengths, defaults to None (no pbc)
+    :type box: np.ndarray, optional
+    :return: symmetric sparse connectivity matrix, (N, N).
+    :rtype: sparse.csr_matrix
+    """
+    positions = np.asarray(positions, dtype=float)
+    if box is not None:
+        positions = wrap_box(positions, box)
+    tree = cKDTree(positions, boxsize=box)
+    pairs = tree.query_pairs(r=2 * radii.max(), output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    d = positions[j] - positions[i]
+    if box is not None:
+        d = minimum_image_box(d, box)
+    bonded = np.linalg.norm(d, axis=1) < radii[i] + radii[j]
+    i, j = i[bonded], j[bonded]
+    N = len(positions)
+    data = np.ones(2 * len(i), dtype=np.int8)
+    return sparse.csr_matrix((data, (np.concatenate([i, j]), np.concatenate([j, i]))),
+                             shape=(N, N))
+
+
+class MoleculeTracker:
+    """Incremental per-frame molecules identification, for reactive
+    (e.g., proton transfer) trajectories.
+    The candidate pairs within the bonding range plus a Verlet skin are
+    searched once with a cKDTree and reused until an atom moves more than
+    half the skin (the skin left after a box rescaling, for NPT runs);
+    at each frame only the bonds among the candidates are checked.
+    Only the molecules whose bonds changed are re-labeled: each new
+    molecule takes the old label it shares most atoms with (ties broken
+    by the heavy atoms), the others take the smallest unused labels,
+    so the IDs stay compact.
+    Only orthorhombic periodic or non periodic cells are supported.
+    """
+
+    def __init__(self,
+                 radii: np.ndarray,
+                 verlet_skin: float = 1.0,
+                 numbers: np.ndarray = None):
+        """
+        :param radii: per atom bonding radii, (N,), see `get_connectivity_matrix`.
+        :type radii: np.ndarray
+        :param verlet_skin: extra range of the candidate pairs, defaults to 1.0
+        :type verlet_skin: float, optional
+        :param numbers: atomic numbers, (N,), for the heavy atoms tie break, defaults to None
+        :type numbers: np.ndarray, optional
+        """
+        self.radii = np.asarray(radii, dtype=float)
+        self._heavy = np.ones(len(self.radii), dtype=bool) if numbers is None \
+                      else np.asarray(numbers) > 1
+        self.verlet_skin = verlet_skin
+        self.n_atoms = len(self.radii)
+        self.events = list()
+        self.molIDs = None
+        self._frame = -1
+        self._bonds = None
+        self._pairs = None
+        self._ref_positions = None
+        self._ref_box = None
+        pass
+
+    def update(self,
+               positions: np.ndarray,
+               box: np.ndarray = None) -> np.ndarray:
+        """Identifies the molecules of the next frame.
+
+        :param positions: atomic positions, (N, 3).
+        :type positions: np.ndarray
+        :param box: orthorhombic box lengths, defaults to None (no pbc)
+        :type box: np.ndarray, optional
+        :return: molecule ID of each atom, (N,).
+        :rtype: np.ndarray
+        """
+        self._frame += 1
+        positions = np.asarray(positions, dtype=float)
+        if box is not None:
+            box = np.asarray(box, dtype=float)
+            positions = wrap_box(positions, box)
+        if self._needs_rebuild(positions, box):
+            self._build_pairs(positions, box)
+        bonds = self._get_bonds(positions, box)
+        if self._bonds is None:
+            _, self.molIDs = sparse.csgraph.connected_components(
+                self._bonds_matrix(bonds, self.n_atoms))
+        else:
+            formed = np.setdiff1d(bonds, self._bonds, assume_unique=True)
+            broken = np.setdiff1d(self._bonds, bonds, assume_unique=True)
+            if len(formed) or len(broken):
+                self._log_events(formed, 'formed')
+                self._log_events(broken, 'broken')
+                self._relabel(bonds, np.concatenate([formed, broken]))
+        self._bonds = bonds
+        return self.molIDs.copy()
+
+    def _needs_rebuild(self,
+                       positions: np.ndarray,
+                       box: np.ndarray) -> bool:
+        if self._pairs is None:
+            return True
+        if (box is None) != (self._ref_box is None):
+            return True
+        skin = self.verlet_skin
+        d = positions - self._ref_positions
+        if box is not None:
+            # compare in the reference box (same fractional coordinates):
+            # a shrinking box brings pairs closer by up to 1 / min(scale)
+            scale = box / self._ref_box
+            d = positions / scale - self._ref_positions
+            d = minimum_image_box(d, self._ref_box)
+            skin -= 2 * self.radii.max() * (1. / scale.min() - 1.)
+        if skin <= 0:
+            return True
+        return np.max(np.einsum('ij,ij->i', d, d)) > (skin / 2) ** 2
+
+    def _build_pairs(self,
+                     positions: np.ndarray,
+                     box: np.ndarray) -> None:
+        tree = cKDTree(positions, boxsize=box)
+        self._pairs = tree.query_pairs(r=2 * self.radii.max() + self.verlet_skin,
+                                       output_type='ndarray')
+        self._ref_positions = positions.copy()
+        self._ref_box = None if box is None else box.copy()
+        pass
+
+    def _get_bonds(self,
+                   positions: np.ndarray,
+                   box: np.ndarray) -> np.ndarray:
+        """Bonds among the candidate pairs, encoded as i*N+j (i < j), sorted.
+        """
+        i, j = self._pairs[:, 0], self._pairs[:, 1]
+        d = positions[j] - positions[i]
+        if box is not None:
+            d = minimum_image_box(d, box)
+        bonded = np.einsum('ij,ij->i', d, d) < (self.radii[i] + self.radii[j]) ** 2
+        lo = np.minimum(i[bonded], j[bonded]).astype(np.int64)
+        hi = np.maximum(i[bonded], j[bonded]).astype(np.int64)
+        return np.sort(lo * self.n_atoms + hi)
+
+    @staticmethod
+    def _bonds_matrix(bonds: np.ndarray,
+                      n: int) -> sparse.csr_matrix:
+        i, j = np.divmod(bonds, n)
+        data = np.ones(len(bonds), dtype=np.int8)
+        return sparse.csr_matrix((data, (i, j)), shape=(n, n))
+
+    def _log_events(self,
+                    bonds: np.ndarray,
+                    event: str) -> None:
+        for i, j in zip(*np.divmod(bonds, self.n_atoms)):
+            self.events.append(dict(frame=self._frame, event=event,
+                                    i=int(i), j=int(j)))
+        pass
+
+    def _relabel(self,
+                 bonds: np.ndarray,
+                 changed: np.ndarray) -> None:
+        """Re-labels only the molecules touched by the changed bonds.
+        """
+        old = self.molIDs
+        touched = np.unique(old[np.concatenate(np.divmod(changed, self.n_atoms))])
+        atoms = np.flatnonzero(np.isin(old, touched))
+        # bonds within the touched atoms, in local indexes
+        i, j = np.divmod(bonds, self.n_atoms)
+        inside = np.isin(i, atoms) & np.isin(j, atoms)
+        local = np.searchsorted(atoms, np.stack([i[inside], j[inside]]))
+        n = len(atoms)
+        _, comp = sparse.csgraph.connected_components(
+            self._bonds_matrix(local[0] * n + local[1], n))
+        n_comp = comp.max() + 1
+        # overlap (atoms, heavy atoms) of each new component with the old labels
+        pair, inverse = np.unique(np.stack([comp, old[atoms]]), axis=1,
+                                  return_inverse=True)
+        inverse = inverse.ravel()
+        overlap = np.bincount(inverse)
+        heavy = np.bincount(inverse, weights=self._heavy[atoms])
+        order = np.lexsort((pair[1], pair[0], -heavy, -overlap))
+        labels = np.full(n_comp, -1)
+        taken = set()
+        for c, label in pair[:, order].T:
+            if labels[c] < 0 and label not in taken:
+                labels[c] = label
+                taken.add(label)
+        # smallest labels not in use anymore, then new ones
+        in_use = set(np.unique(np.delete(old, atoms)).tolist()) | taken
+        free = (l for l in count() if l not in in_use)
+        for c in np.flatnonzero(labels < 0):
+            labels[c] = next(free)
+            in_use.add(labels[c])
+        new = old.copy()
+        new[atoms] = labels[comp]
+        self.molIDs = new
+        pass
+
+
+def track_molecules(ase_db: Iterable[ase.ase.Atoms],
+                    fct: Union[float, dict],
+                    skin: float = 0.3,
+                    verlet_skin: float = 1.0,
+                    chunk_size: int = 1000) -> Tuple[np.ndarray, list]:
+    """Per-frame molecules identification along a (reactive) trajectory,
+    see `MoleculeTracker`.
+
+    :param ase_db: ase atoms database (or iterator) of frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
+    :param fct: scaling parameters for the LJ cutoffs.
+    :type fct: Union[float, dict]
+    :param skin: skin added to each cutoff, defaults to 0.3 (ase default)
+    :type skin: float, optional
+    :param verlet_skin: extra range of the candidate pairs, defaults to 1.0
+    :type verlet_skin: float, optional
+    :param chunk_size: frames per chunk, defaults to 1000
+    :type chunk_size: int, optional
+    :raises ValueError: for triclinic or partially periodic cells.
+    :return: per-frame molecule IDs (T, N) and the bonds events log.
+    :rtype: Tuple[np.ndarray, list]
+    """
+    tracker = None
+    molIDs = list()
+    for chunk in tqdm(frame_chunks(ase_db, chunk_size), desc='Tracking molecules'):
+        positions, cells = frames_to_arrays(chunk)
+        if tracker is None:
+            at0 = chunk[0]
+            if np.any(at0.pbc) and not np.all(at0.pbc):
+                raise ValueError("Partially periodic cells are not supported.")
+            periodic = bool(np.all(at0.pbc))
+            radii = np.asarray(modif_natural_cutoffs(at0, fct)) + skin
+            tracker = MoleculeTracker(radii=radii, verlet_skin=verlet_skin,
+                                      numbers=at0.numbers)
+        for xyz, cell in zip(positions, cells):
+            box = None
+            if periodic:
+                box = np.diagonal(cell)
+                if not np.allclose(cell, np.diag(box)):
+                    raise ValueError("Triclinic cells are not supported.")
+            molIDs.append(tracker.update(xyz, box).astype(np.int32))
+    if tracker is None:
+        return np.empty((0, 0), dtype=np.int32), list()
+    return np.array(molIDs), tracker.events
+
+
 def modif_natural_cutoffs(at: ase.ase.Atoms,
                           fct: Union[float, dict]) -> dict:
     """Modifies the natural cutoff of the LJ interactions.
@@ -187,101 +520,358 @@ def modif_natural_cutoffs(at: ase.ase.Atoms,
 def ZnumberShift(Znumbers: np.ndarray, 
                  molSymbols: list,
                  molIDs: list,
-                 to_shift: Tuple[str, list]) -> np.ndarray:
-    """_summary_
+                 to_shift: Union[Tuple[str, list], List[Tuple[str, list]]]) -> np.ndarray:
+    """Shifts the Z numbers of selected atoms of selected molecules
+    (by the max Z number of the system), e.g., to tell apart the same
+    element in different molecules. The atoms masks are computed with
+    array operations, all the rules in a single pass.
 
-    :param Znumbers: _description_
+    :param Znumbers: atomic numbers, (N,).
     :type Znumbers: np.ndarray
-    :param molSymbols: _description_
+    :param molSymbols: list of molecule-wise symbols, indexed by the molecules IDs.
     :type molSymbols: list
-    :param molIDs: _description_
+    :param molIDs: molecule ID of each atom, (N,).
     :type molIDs: list
-    :param to_shift: _description_
-    :type to_shift: Tuple[str, list]
-    :return: _description_
+    :param to_shift: (molecule symbol, Z numbers list) rule, or list of rules.
+    :type to_shift: Union[Tuple[str, list], List[Tuple[str, list]]]
+    :return: shifted atomic numbers, (N,).
     :rtype: np.ndarray
     """
-    mol_to_shift, Z_to_shift = to_shift
+    Znumbers = np.asarray(Znumbers)
+    rules = [to_shift] if isinstance(to_shift[0], str) else to_shift
     dummy = np.max(Znumbers)
+    # molecule symbol of each atom
+    atoms_molSym = np.asarray(molSymbols)[np.asarray(molIDs)]
+    to_shift_mask = np.zeros(len(Znumbers), dtype=bool)
+    for mol_to_shift, Z_to_shift in rules:
+        to_shift_mask |= ((atoms_molSym == mol_to_shift) & 
+                          np.isin(Znumbers, Z_to_shift))
     shifted_Znumbers = Znumbers.copy()
-    #
-    for idx, mol in enumerate(molSymbols):
-        if mol == mol_to_shift:
-            mask = molIDs == idx
-            #
-            for i, tgt in enumerate(mask):
-                if tgt:
-                    if shifted_Znumbers[i] in Z_to_shift:
-                        shifted_Znumbers[i] += dummy
-                    else:
-                        pass
+    shifted_Znumbers[to_shift_mask] += dummy
     return shifted_Znumbers
 
 
-def center_of_mass(ase_db: List[ase.ase.Atoms],
+class MolecularCOM:
+    """Vectorized molecular center of mass engine.
+    The mass weights and the molecule-index map are computed once,
+    then the COMs of a whole (T, N, 3) block of positions are a single
+    weighted segment sum over the atoms sorted by molecule.
+
+    With `pbc` the molecules split by the periodic boundaries are made
+    whole before the reduction, with minimum image displacements:
+    - 'reference': from the first atom of each molecule;
+    - 'bonds': along the bonds graph (`conMat`), level by level of a
+      breadth first tree, for molecules larger than half the box.
+    The COMs are then wrapped back into the cell.
+    """
+
+    def __init__(self,
+                 masses: np.ndarray,
+                 molIDs: np.ndarray,
+                 pbc: str = None,
+                 conMat: sparse.spmatrix = None):
+        """
+        :param masses: atomic masses, (N,).
+        :type masses: np.ndarray
+        :param molIDs: molecule ID of each atom, (N,).
+        :type molIDs: np.ndarray
+        :param pbc: whole molecules mode, 'reference' or 'bonds', defaults to None
+        :type pbc: str, optional
+        :param conMat: sparse connectivity matrix, needed by 'bonds', defaults to None
+        :type conMat: sparse.spmatrix, optional
+        :raises NameError: if the pbc mode is not supported.
+        :raises ValueError: if 'bonds' is chosen without a connectivity matrix.
+        """
+        masses = np.asarray(masses, dtype=float)
+        molIDs = np.asarray(molIDs)
+        # atoms sorted by molecule, molecules in np.unique order
+        self._order = np.argsort(molIDs, kind='stable')
+        self.molecules, self._starts, counts = np.unique(molIDs[self._order],
+                                                         return_index=True,
+                                                         return_counts=True)
+        molMass = np.add.reduceat(masses[self._order], self._starts)
+        self._weights = masses[self._order] / np.repeat(molMass, counts)
+        # whole molecules tree: atoms to place, level by level, and parents
+        self.pbc = pbc
+        roots = self._order[self._starts]
+        if pbc is None:
+            self._levels = list()
+        elif pbc == 'reference':
+            child = np.setdiff1d(np.arange(len(molIDs)), roots)
+            parent = roots[np.searchsorted(self.molecules, molIDs[child])]
+            self._levels = [(child, parent)]
+        elif pbc == 'bonds':
+            if conMat is None:
+                raise ValueError("`conMat` is needed by the 'bonds' pbc mode.")
+            self._levels = bfs_levels(conMat=conMat, roots=roots)
+        else:
+            raise NameError(f"Unknown pbc mode '{pbc}'.\n"
+                            "Choose from: None, 'reference', 'bonds'.")
+        pass
+
+    @property
+    def n_molecules(self) -> int:
+        """Number of molecules M.
+
+        :return: number of molecules.
+        :rtype: int
+        """
+        return len(self.molecules)
+
+    def fit(self,
+            positions: np.ndarray,
+            cells: np.ndarray = None) -> np.ndarray:
+        """Computes the molecular COMs.
+
+        :param positions: atomic positions, (N, 3) or (T, N, 3).
+        :type positions: np.ndarray
+        :param cells: cells, (3, 3) or (T, 3, 3), needed with pbc, defaults to None
+        :type cells: np.ndarray, optional
+        :raises ValueError: if pbc is set without the cells.
+        :return: molecular COMs, (M, 3) or (T, M, 3).
+        :rtype: np.ndarray
+        """
+        positions = np.asarray(positions, dtype=float)
+        if self.pbc is not None:
+            if cells is None:
+                raise ValueError("`cells` are needed to make the molecules whole.")
+            single = positions.ndim == 2
+            positions = positions[np.newaxis] if single else positions
+            cells = np.asarray(cells, dtype=float).reshape(-1, 3, 3)
+            positions = self._make_whole(positions, cells)
+        weighted = positions[..., self._order, :] * self._weights[:, np.newaxis]
+        com = np.add.reduceat(weighted, self._starts, axis=-2)
+        if self.pbc is not None:
+            com = wrap_positions(com, cells)
+            if single:
+                com = com[0]
+        return com
+
+    def _make_whole(self,
+                    positions: np.ndarray,
+                    cells: np.ndarray) -> np.ndarray:
+        """Places each atom at the minimum image of its parent, level by level.
+        """
+        whole = positions.copy()
+        for child, parent in self._levels:
+            d = minimum_image(positions[:, child] - positions[:, parent], cells)
+            whole[:, child] = whole[:, parent] + d
+        return whole
+
+
+def bfs_levels(conMat: sparse.spmatrix,
+               roots: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Breadth first tree of a bonds graph, from the given roots,
+    vectorized over the whole frontier at each level.
+
+    :param conMat: sparse connectivity matrix, (N, N).
+    :type conMat: sparse.spmatrix
+    :param roots: one root atom per connected component.
+    :type roots: np.ndarray
+    :return: list of (children, parents) atoms indexes, one per tree level.
+    :rtype: List[Tuple[np.ndarray, np.ndarray]]
+    """
+    conMat = sparse.csr_matrix(conMat)
+    visited = np.zeros(conMat.shape[0], dtype=bool)
+    visited[roots] = True
+    frontier = np.asarray(roots)
+    levels = list()
+    while len(frontier):
+        sub = conMat[frontier].tocoo()
+        rows, cols = sub.row, sub.col
+        new = ~visited[cols]
+        child, first = np.unique(cols[new], return_index=True)
+        if len(child) == 0:
+            break
+        parent = frontier[rows[new][first]]
+        visited[child] = True
+        levels.append((child, parent))
+        frontier = child
+    return levels
+
+
+def frames_to_arrays(chunk: Union[List[ase.ase.Atoms], TrajStore]
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+    """Stacks the positions and cells of a chunk of frames.
+
+    :param chunk: list of frames or store view.
+    :type chunk: Union[List[ase.ase.Atoms], TrajStore]
+    :return: positions (t, N, 3) and cells (t, 3, 3).
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    if isinstance(chunk, TrajStore):
+        return chunk.positions, chunk.cell
+    positions = np.array([at.positions for at in chunk])
+    cells = np.array([at.cell[:] for at in chunk])
+    return positions, cells
+
+
+def center_of_mass(ase_db: Iterable[ase.ase.Atoms],
                    molSymbols: list,
-                   molIDs: list) -> List[ase.ase.Atoms]:
+                   molIDs: list,
+                   masses: np.ndarray = None,
+                   chunk_size: int = 1000,
+                   as_array: bool = False,
+                   pbc: str = None,
+                   conMat: sparse.spmatrix = None) -> Union[List[ase.ase.Atoms], np.ndarray]:
     """Computes the COM of a given ase atoms databas of frames.
+    The frames are processed in chunks with `MolecularCOM`.
 
-    :param ase_db: ase atoms database.
-    :type ase_db: List[ase.ase.Atoms]
+    :param ase_db: ase atoms database (or iterator) of frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
     :param molSymbols: list of molecule-wise symbols as they appear in the frame configuration.
     :type molSymbols: list
     :param molIDs: list of molecule-wise ids as they appear in the frame configuration.
     :type molIDs: list
-    :return: ase atoms database containitng the COM position.
-    :rtype: List[ase.ase.Atoms]
+    :param masses: atomic masses, defaults to None (i.e., from the first frame)
+    :type masses: np.ndarray, optional
+    :param chunk_size: frames per chunk, defaults to 1000
+    :type chunk_size: int, optional
+    :param as_array: return the compact (T, M, 3) COM array, defaults to False
+    :type as_array: bool, optional
+    :param pbc: make the molecules whole, 'reference' or 'bonds', defaults to None
+    :type pbc: str, optional
+    :param conMat: sparse connectivity matrix, needed by 'bonds', defaults to None
+    :type conMat: sparse.spmatrix, optional
+    :return: ase atoms database containitng the COM position, or the COM array.
+    :rtype: Union[List[ase.ase.Atoms], np.ndarray]
     """
+    com_engine = None
+    com_chunks = list()
+    cell_chunks = list()
+    for chunk in tqdm(frame_chunks(ase_db, chunk_size), desc='Computing COM:'):
+        positions, cells = frames_to_arrays(chunk)
+        if com_engine is None:
+            if masses is None:
+                masses = chunk.masses if isinstance(chunk, TrajStore) \
+                    else chunk[0].get_masses()
+            com_engine = MolecularCOM(masses=masses, molIDs=molIDs,
+                                      pbc=pbc, conMat=conMat)
+        com_chunks.append(com_engine.fit(positions, cells))
+        cell_chunks.append(cells)
+    if com_engine is None:
+        return np.empty((0, 0, 3)) if as_array else list()
+    com = np.concatenate(com_chunks)
+    if as_array:
+        return com
+    cells = np.concatenate(cell_chunks)
     ase_db_com_list = list()
-    for at in tqdm(ase_db, desc='Computing COM:'):
-        mol_com_tmp = list()
-        for m in np.unique(molIDs):
-            mol = at[molIDs==m] #copy by value
-            mass = mol.get_masses()
-            cm = np.sum(mol.positions*mass.reshape(-1,1), axis=0)/np.sum(mass)
-            mol_com_tmp.append(cm)
-        new_com_at = Atoms(positions=np.array(mol_com_tmp), pbc=True, cell=at.cell)
+    for cm, cell in zip(com, cells):
+        new_com_at = Atoms(positions=cm, pbc=True, cell=cell)
         new_com_at.arrays['molSym'] = np.array(molSymbols)
         ase_db_com_list.append(new_com_at)
     return ase_db_com_list
 
+def rdf_accumulate(ase_db: Iterable[ase.ase.Atoms],
+                   r_max: float,
+                   sel_a: np.ndarray,
+                   sel_b: np.ndarray = None,
+                   bins: int = 200,
+                   com_engine: MolecularCOM = None,
+                   chunk_size: int = 1000) -> RDF:
+    """Accumulates the RDF between two selections over the frames,
+    streaming them in chunks (see `computes.rdf.RDF`).
+
+    :param ase_db: ase atoms database (or iterator) of frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
+    :param r_max: largest distance.
+    :type r_max: float
+    :param sel_a: indexes of the first selection (atoms, or molecules with `com_engine`).
+    :type sel_a: np.ndarray
+    :param sel_b: indexes of the second selection, defaults to None (same as sel_a)
+    :type sel_b: np.ndarray, optional
+    :param bins: number of bins, defaults to 200
+    :type bins: int, optional
+    :param com_engine: molecules COM engine for molecule-level RDFs, defaults to None
+    :type com_engine: MolecularCOM, optional
+    :param chunk_size: frames per chunk, defaults to 1000
+    :type chunk_size: int, optional
+    :return: RDF accumulator.
+    :rtype: RDF
+    """
+    rdf = RDF(r_max=r_max, bins=bins)
+    for chunk in frame_chunks(ase_db, chunk_size):
+        positions, cells = frames_to_arrays(chunk)
+        if com_engine is not None:
+            positions = com_engine.fit(positions, cells)
+        B = None if sel_b is None else positions[:, sel_b]
+        rdf.partial_fit(A=positions[:, sel_a], cells=cells, B=B)
+    return rdf
+
+
+def frame_chunks(ase_db: Iterable[ase.ase.Atoms],
+                 chunk_size: int = None) -> Iterator[List[ase.ase.Atoms]]:
+    """Groups an iterable of frames (e.g., a list or `ase.io.iread`)
+    into consecutive chunks, without materializing the whole trajectory.
+
+    :param ase_db: iterable of ase atoms frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
+    :param chunk_size: frames per chunk, defaults to None (single chunk).
+    :type chunk_size: int, optional
+    :yield: list of consecutive frames (a store view for a TrajStore).
+    :rtype: Iterator[List[ase.ase.Atoms]]
+    """
+    if isinstance(ase_db, TrajStore):
+        # slices of the store are zero-copy views
+        step = len(ase_db) if chunk_size is None else chunk_size
+        for b in range(0, len(ase_db), max(step, 1)):
+            yield ase_db[b:b + step]
+        return
+    frames = iter(ase_db)
+    while True:
+        chunk = list(islice(frames, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 @misc.my_timer
-def ase_mol_unwrap(ase_db: List[ase.ase.Atoms], 
+def ase_mol_unwrap(ase_db: Iterable[ase.ase.Atoms], 
                    molecule_to_unwrap: List[str], 
                    molSymbols: list,
-                   method: str) -> dict:
-    """_summary_
-
-    :param ase_db: _description_
-    :type ase_db: List[ase.ase.Atoms]
-    :param molecule_to_unwrap: _description_
-    :type molecule_to_unwrap: str
-    :param molSymbols: _description_
+                   method: str,
+                   chunk_size: int = None) -> dict:
+    """Unwraps the positions of the selected molecules along the trajectory.
+    The frames are consumed in chunks of `chunk_size`, carrying over
+    the unwrapping state, so `ase_db` can also be a lazy iterator.
+
+    :param ase_db: ase atoms database (or iterator) of frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
+    :param molecule_to_unwrap: molecules symbols to unwrap.
+    :type molecule_to_unwrap: List[str]
+    :param molSymbols: list of molecule-wise symbols as they appear in the frame configuration.
     :type molSymbols: list
-    :param method: _description_
+    :param method: unwrapping method, see `computes.traj.XYZunwrapper`.
     :type method: str
-    :return: _description_
+    :param chunk_size: frames per chunk, defaults to None (whole trajectory).
+    :type chunk_size: int, optional
+    :return: dictionary of molecule symbol: list of (T, 3) unwrapped coordinates.
     :rtype: dict
     """
-    # - init unwrapping
-    unwrap_obj = traj.XYZunwrapper(method=method)
-    print(f"Chosen method: {unwrap_obj._method.__doc__}\n")
-    unwrap_coord_dict = dict()
+    # - init unwrapping, one state per molecule kind
+    unwrap_objs = [traj.XYZunwrapper(method=method) for _ in molecule_to_unwrap]
+    print(f"Chosen method: {unwrap_objs[0]._method.__doc__}\n")
+    unwrap_chunks = [list() for _ in molecule_to_unwrap]
     # - unwrapping quantitities
-    box_values = [at.cell[0][0] for at in ase_db]
     mol_to_unwrap_idxs = [
         [i for i,s in enumerate(molSymbols) if s == mol] 
         for mol in molecule_to_unwrap
     ]
-    # unwrapping
-    for i,mask in enumerate(mol_to_unwrap_idxs):
-        unwrap_coord_dict[molecule_to_unwrap[i]] = list()
-        for idx in tqdm(mask, desc=f"Unwrapping: {molecule_to_unwrap[i]}"):
-            # get the wrapped coordinates
-            wrapped_coords_tmp = np.array([at[idx].position for at in ase_db])
+    # unwrapping, all the molecules of a kind at once
+    for chunk in tqdm(frame_chunks(ase_db, chunk_size), desc='Unwrapping chunks'):
+        positions, cells = frames_to_arrays(chunk)
+        box_values = np.diagonal(cells, axis1=1, axis2=2)
+        for i,mask in enumerate(mol_to_unwrap_idxs):
+            # get the wrapped coordinates (t, N, 3)
+            wrapped_coords_tmp = positions[:, mask]
             # get the unwrapped coordinates
-            unwrap_coord_dict[molecule_to_unwrap[i]].append(
-                unwrap_obj.fit(xyz=wrapped_coords_tmp,
-                               box=box_values)
+            unwrap_chunks[i].append(
+                unwrap_objs[i].partial_fit(xyz=wrapped_coords_tmp,
+                                           box=box_values)
             )
-    return unwrap_coord_dict
\ No newline at end of file
+    unwrap_coord_dict = dict()
+    for i,mask in enumerate(mol_to_unwrap_idxs):
+        unwrapped_coords_tmp = np.concatenate(unwrap_chunks[i])
+        unwrap_coord_dict[molecule_to_unwrap[i]] = [
+            unwrapped_coords_tmp[:, j, :] for j in range(len(mask))
+        ]
+    return unwrap_coord_dict
@@ -0,0 +1,351 @@
+# -------------------------------------------------- #
+# ASE tools - lazy trajectory reader
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import io
+import os
+import re
+import numpy as np
+import ase
+from ase.io import read
+from ase.io.formats import filetype
+from typing import Union, Iterator
+
+# -------------------------------------------------- #
+# --- Frame index
+
+LAZY_FORMATS = ('xyz', 'extxyz')
+INDEX_VERSION = 1
+_LATTICE_RE = re.compile(rb'Lattice="([^"]*)"')
+
+
+def is_lazy_readable(trajPath: str) -> bool:
+    """Checks if a trajectory file can be read lazily,
+    i.e., if it is in the (ext)xyz text format.
+
+    :param trajPath: path of the trajectory file.
+    :type trajPath: str
+    :return: True if the file format supports lazy reading.
+    :rtype: bool
+    """
+    try:
+        return filetype(trajPath, guess=False) in LAZY_FORMATS
+    except Exception:
+        return False
+
+
+def scan_frames(trajPath: str,
+                start: int = 0) -> dict:
+    """Scans a (ext)xyz trajectory from the byte `start` (a frame start)
+    and gets the frames byte offsets, atoms counts and cells.
+    An incomplete last frame (e.g., a running simulation) is left out.
+
+    :param trajPath: path of the trajectory file.
+    :type trajPath: str
+    :param start: byte offset where to start the scan, defaults to 0
+    :type start: int, optional
+    :raises ValueError: if a frame header is not an atom count.
+    :return: dictionary with `offsets` (T+1,), `natoms` (T,) and `cell` (T, 3, 3).
+    :rtype: dict
+    """
+    offsets = list()
+    natoms_list = list()
+    cells = list()
+    pos = start
+    with open(trajPath, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if not line.strip():
+                pos += len(line)
+                continue
+            try:
+                natoms = int(line)
+            except ValueError:
+                raise ValueError(f"Corrupted frame header at byte {pos}: {line[:80]}")
+            # comment line and atoms lines
+            frame_lines = [next(f, b'') for _ in range(natoms + 1)]
+            # file ended before the last line of the frame
+            if frame_lines[-1] == b'':
+                break
+            offsets.append(pos)
+            natoms_list.append(natoms)
+            cells.append(_parse_lattice(frame_lines[0]))
+            pos += len(line) + sum(len(l) for l in frame_lines)
+    offsets.append(pos)
+    return dict(
+        offsets = np.array(offsets, dtype=np.int64),
+        natoms = np.array(natoms_list, dtype=np.int64),
+        cell = np.array(cells, dtype=float).reshape(-1, 3, 3)
+    )
+
+
+def _parse_lattice(comment: bytes) -> np.ndarray:
+    """Gets the cell from an extxyz comment line (zeros if missing).
+    """
+    match = _LATTICE_RE.search(comment)
+    if match is None:
+        return np.zeros((3, 3))
+    return np.array(match.group(1).split(), dtype=float).reshape(3, 3)
+
+
+def build_frame_index(trajPath: str) -> np.ndarray:
+    """Scans a (ext)xyz trajectory once and gets the byte offsets
+    of the frames starts.
+
+    :param trajPath: path of the trajectory file.
+    :type trajPath: str
+    :return: offsets array of shape (T+1,), the last entry is the end of the last frame.
+    :rtype: np.ndarray
+    """
+    return scan_frames(trajPath)['offsets']
+
+# -------------------------------------------------- #
+# --- Frame index cache
+
+def index_cache_path(trajPath: str) -> str:
+    """Path of the sidecar index file of a trajectory.
+
+    :param trajPath: path of the trajectory file.
+    :type trajPath: str
+    :return: path of the index file, next to the trajectory.
+    :rtype: str
+    """
+    folder, name = os.path.split(os.path.abspath(trajPath))
+    return os.path.join(folder, f'.{name}.phdidx.npz')
+
+
+def load_frame_index(trajPath: str,
+                     cache: bool = True) -> dict:
+    """Gets the frame index of a (ext)xyz trajectory, using the
+    sidecar index file when valid (same size and mtime of the trajectory).
+    If the trajectory has grown the index is extended by scanning
+    only the new bytes, otherwise it is rebuilt from scratch.
+
+    :param trajPath: path of the trajectory file.
+    :type trajPath: str
+    :param cache: read and write the sidecar index file, defaults to True
+    :type cache: bool, optional
+    :return: dictionary with `offsets` (T+1,), `natoms` (T,) and `cell` (T, 3, 3).
+    :rtype: dict
+    """
+    if not cache:
+        return scan_frames(trajPath)
+    stat = os.stat(trajPath)
+    cachePath = index_cache_path(trajPath)
+    index = None
+    try:
+        with np.load(cachePath) as npz:
+            index = {k: npz[k] for k in npz.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    if index is not None and index.get('version', -1) == INDEX_VERSION:
+        same_file = (index['size'] == stat.st_size and
+                     index['mtime'] == stat.st_mtime_ns)
+        if same_file:
+            return _strip_stat(index)
+        if stat.st_size >= index['size'] and _last_frame_is_valid(trajPath, index):
+            # grown trajectory: scan only the tail
+            tail = scan_frames(trajPath, start=int(index['offsets'][-1]))
+            index = dict(
+                offsets = np.concatenate([index['offsets'][:-1], tail['offsets']]),
+                natoms = np.concatenate([index['natoms'], tail['natoms']]),
+                cell = np.concatenate([index['cell'], tail['cell']])
+            )
+        else:
+            index = scan_frames(trajPath)
+    else:
+        index = scan_frames(trajPath)
+    _save_frame_index(cachePath, index, stat)
+    return _strip_stat(index)
+
+
+def _last_frame_is_valid(trajPath: str,
+                         index: dict) -> bool:
+    """Checks that the last indexed frame still starts where expected.
+    """
+    if len(index['natoms']) == 0:
+        return True
+    with open(trajPath, 'rb') as f:
+        f.seek(int(index['offsets'][-2]))
+        try:
+            return int(f.readline()) == index['natoms'][-1]
+        except ValueError:
+            return False
+
+
+def _save_frame_index(cachePath: str,
+                      index: dict,
+                      stat: os.stat_result) -> None:
+    """Writes the sidecar index file (skipped if not writable).
+    """
+    try:
+        with open(cachePath, 'wb') as f:
+            np.savez(f,
+                     version=INDEX_VERSION,
+                     size=stat.st_size,
+                     mtime=stat.st_mtime_ns,
+                     **_strip_stat(index))
+    except OSError as error:
+        print(f"!!! Warning: index file not saved ({error})")
+    pass
+
+
+def _strip_stat(index: dict) -> dict:
+    return {k: index[k] for k in ('offsets', 'natoms', 'cell')}
+
+# -------------------------------------------------- #
+# --- Lazy trajectory
+
+class LazyTraj:
+    """Lazy, random-access view of a (ext)xyz trajectory.
+    The frames byte offsets are computed once and the frames are
+    decoded into ase.Atoms only when accessed.
+    Slicing returns a new view sharing the same index.
+    """
+
+    def __init__(self,
+                 trajPath: str,
+                 index: dict = None,
+                 frames: np.ndarray = None,
+                 cache: bool = True,
+                 numbers: np.ndarray = None):
+        """
+        :param trajPath: path of the trajectory file.
+        :type trajPath: str
+        :param index: precomputed frame index, see `load_frame_index`, defaults to None
+        :type index: dict, optional
+        :param frames: frames indexes of the view, defaults to None (all)
+        :type frames: np.ndarray, optional
+        :param cache: use the sidecar index file, defaults to True
+        :type cache: bool, optional
+        :param numbers: atomic numbers override of the decoded frames, defaults to None
+        :type numbers: np.ndarray, optional
+        """
+        self.trajPath = trajPath
+        if index is None:
+            index = load_frame_index(trajPath, cache=cache)
+        self._index = index
+        self._offsets = index['offsets']
+        if frames is None:
+            frames = np.arange(len(self._offsets) - 1)
+        self._frames = np.asarray(frames, dtype=np.int64)
+        self.numbers = numbers
+        self._fh = None
+        pass
+
+    def with_numbers(self,
+                     numbers: np.ndarray) -> 'LazyTraj':
+        """View of the same frames with the atomic numbers overridden
+        (e.g., Z shifted), applied lazily when the frames are decoded.
+
+        :param numbers: atomic numbers, (N,).
+        :type numbers: np.ndarray
+        :return: trajectory view.
+        :rtype: LazyTraj
+        """
+        return LazyTraj(trajPath=self.trajPath,
+                        index=self._index,
+                        frames=self._frames,
+                        numbers=numbers)
+
+    @property
+    def frames(self) -> np.ndarray:
+        """Frames indexes (in the file) of the view.
+
+        :return: frames indexes.
+        :rtype: np.ndarray
+        """
+        return self._frames
+
+    @property
+    def natoms(self) -> np.ndarray:
+        """Number of atoms per frame of the view (no decoding).
+
+        :return: atoms counts, (T,).
+        :rtype: np.ndarray
+        """
+        return self._index['natoms'][self._frames]
+
+    @property
+    def cells(self) -> np.ndarray:
+        """Cell per frame of the view (no decoding), zeros if not in the file.
+
+        :return: cells, (T, 3, 3).
+        :rtype: np.ndarray
+        """
+        return self._index['cell'][self._frames]
+
+    @property
+    def n_frames_file(self) -> int:
+        """Total number of frames in the file.
+
+        :return: number of frames.
+        :rtype: int
+        """
+        return len(self._offsets) - 1
+
+    @property
+    def frame_index(self) -> dict:
+        """Frame index of the whole file, plain arrays that can be
+        pickled (e.g., to worker processes) and given back as `index`.
+
+        :return: dictionary with `offsets`, `natoms` and `cell`.
+        :rtype: dict
+        """
+        return _strip_stat(self._index)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __getitem__(self,
+                    key: Union[int, slice, list, np.ndarray]
+                    ) -> Union[ase.ase.Atoms, 'LazyTraj']:
+        if isinstance(key, (int, np.integer)):
+            return self._read_frame(self._frames[key])
+        return LazyTraj(trajPath=self.trajPath,
+                        index=self._index,
+                        frames=self._frames[key],
+                        numbers=self.numbers)
+
+    def __iter__(self) -> Iterator[ase.ase.Atoms]:
+        for f in self._frames:
+            yield self._read_frame(f)
+
+    def __repr__(self) -> str:
+        return f"LazyTraj('{self.trajPath}', frames={len(self)})"
+
+    def __getstate__(self) -> dict:
+        # the file handle is not shared between processes
+        state = self.__dict__.copy()
+        state['_fh'] = None
+        return state
+
+    def _read_frame(self,
+                    f: int) -> ase.ase.Atoms:
+        """Decodes a single frame of the file.
+
+        :param f: frame index in the file.
+        :type f: int
+        :return: atoms configuration.
+        :rtype: ase.ase.Atoms
+        """
+        if self._fh is None:
+            self._fh = open(self.trajPath, 'rb')
+        b, e = self._offsets[f], self._offsets[f + 1]
+        self._fh.seek(b)
+        text = self._fh.read(e - b).decode()
+        at = read(io.StringIO(text), format='extxyz', index=0)
+        if self.numbers is not None:
+            at.numbers = self.numbers
+        return at
+
+    def close(self) -> None:
+        """Closes the underlying file handle.
+        """
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        pass
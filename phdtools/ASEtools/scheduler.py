@@ -0,0 +1,168 @@
+# -------------------------------------------------- #
+# ASE tools - parallel frames scheduler
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import os
+import functools
+import numpy as np
+import ase
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, List, Callable, Any
+from .lazytraj import LazyTraj
+from .trajstore import TrajStore
+
+# -------------------------------------------------- #
+# --- Worker side
+
+# trajectory opened once per worker process
+_WORKER_TRAJ = None
+
+
+def _open_worker_traj(kind: str,
+                      path: str,
+                      numbers: np.ndarray = None,
+                      index: dict = None) -> None:
+    """Worker initializer: opens the trajectory independently
+    (the lazy trajectories reuse the parent frame index).
+    """
+    global _WORKER_TRAJ
+    if kind == 'lazy':
+        _WORKER_TRAJ = LazyTraj(path, index=index, numbers=numbers)
+    else:
+        _WORKER_TRAJ = TrajStore(path, numbers=numbers)
+    pass
+
+
+def _run_chunk(func: Callable,
+               frames: Union[np.ndarray, List[ase.ase.Atoms]],
+               per_frame: bool,
+               kwargs: dict) -> Any:
+    """Runs an analysis on a chunk of frames, seeking the chunk
+    in the worker trajectory when `frames` are indexes.
+    """
+    if isinstance(frames, np.ndarray):
+        chunk = _WORKER_TRAJ[frames]
+    else:
+        chunk = frames
+    if per_frame:
+        return [func(at, **kwargs) for at in chunk]
+    return func(chunk, **kwargs)
+
+# -------------------------------------------------- #
+# --- Scheduler
+
+class FrameScheduler:
+    """Frame-block scheduler: partitions the frames of a trajectory in
+    chunks and farms them out to a process pool. Each worker opens the
+    file on its own and seeks to its chunks; the results are
+    reassembled in the frames order.
+    Lazy trajectories (LazyTraj) and stores (TrajStore) are opened by
+    path, lists of ase.Atoms are sent to the workers chunk by chunk.
+    """
+
+    def __init__(self,
+                 n_workers: int = None,
+                 chunk_size: int = 100):
+        """
+        :param n_workers: number of worker processes, defaults to None (all cores)
+        :type n_workers: int, optional
+        :param chunk_size: frames per chunk, defaults to 100
+        :type chunk_size: int, optional
+        """
+        self.n_workers = n_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        pass
+
+    def map_chunks(self,
+                   func: Callable,
+                   traj: Union[LazyTraj, TrajStore, List[ase.ase.Atoms]],
+                   **kwargs) -> Union[np.ndarray, list]:
+        """Applies `func(chunk, **kwargs)` to each chunk of frames.
+        `func` must be picklable (e.g., a module level function).
+
+        :param func: chunk analysis, takes a list or view of frames.
+        :type func: Callable
+        :param traj: trajectory.
+        :type traj: Union[LazyTraj, TrajStore, List[ase.ase.Atoms]]
+        :return: results concatenated in the frames order.
+        :rtype: Union[np.ndarray, list]
+        """
+        return self._map(func, traj, per_frame=False, kwargs=kwargs)
+
+    def map_frames(self,
+                   func: Callable,
+                   traj: Union[LazyTraj, TrajStore, List[ase.ase.Atoms]],
+                   **kwargs) -> list:
+        """Applies `func(at, **kwargs)` to each frame.
+        `func` must be picklable (e.g., a module level function).
+
+        :param func: frame analysis, takes an ase.Atoms.
+        :type func: Callable
+        :param traj: trajectory.
+        :type traj: Union[LazyTraj, TrajStore, List[ase.ase.Atoms]]
+        :return: per-frame results in the frames order.
+        :rtype: list
+        """
+        return self._map(func, traj, per_frame=True, kwargs=kwargs)
+
+    def _map(self,
+             func: Callable,
+             traj: Union[LazyTraj, TrajStore, List[ase.ase.Atoms]],
+             per_frame: bool,
+             kwargs: dict) -> Union[np.ndarray, list]:
+        initializer, initargs = None, ()
+        if isinstance(traj, LazyTraj):
+            initializer, initargs = _open_worker_traj, ('lazy', traj.trajPath,
+                                                         traj.numbers,
+                                                         traj.frame_index)
+            frames = traj.frames
+        elif isinstance(traj, TrajStore):
+            initializer, initargs = _open_worker_traj, ('store', traj.storePath,
+                                                         traj.numbers)
+            frames = np.asarray(traj._frame_numbers)
+        else:
+            frames = None
+        n = len(traj)
+        bounds = range(0, n, self.chunk_size)
+        if frames is not None:
+            tasks = [frames[b:b + self.chunk_size] for b in bounds]
+        else:
+            tasks = [list(traj[b:b + self.chunk_size]) for b in bounds]
+        run = functools.partial(_run_chunk, func,
+                                per_frame=per_frame, kwargs=kwargs)
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 initializer=initializer,
+                                 initargs=initargs) as pool:
+            results = list(tqdm(pool.map(run, tasks),
+                                total=len(tasks),
+                                desc=f'Chunks ({self.n_workers} workers)'))
+        return concatenate_results(results)
+
+
+def concatenate_results(results: list) -> Union[np.ndarray, list]:
+    """Reassembles the chunks results: arrays are concatenated along
+    the frames axis, lists are chained, tuples (multiple outputs) are
+    reassembled element by element and anything else is collected
+    in a list (e.g., accumulators to be merged).
+
+    :param results: chunks results, in order.
+    :type results: list
+    :return: whole results.
+    :rtype: Union[np.ndarray, list]
+    """
+    if results and all(isinstance(r, np.ndarray) for r in results):
+        return np.concatenate(results)
+    if results and all(isinstance(r, tuple) for r in results) and \
+       len(set(len(r) for r in results)) == 1:
+        return tuple(concatenate_results(list(items)) for items in zip(*results))
+    whole = list()
+    for r in results:
+        if isinstance(r, list):
+            whole.extend(r)
+        else:
+            whole.append(r)
+    return whole
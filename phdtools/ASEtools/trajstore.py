@@ -0,0 +1,207 @@
+# -------------------------------------------------- #
+# ASE tools - columnar binary trajectory store
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import os
+import json
+import numpy as np
+import ase
+from ase import Atoms
+from tqdm import tqdm
+from typing import Union, Iterable, Iterator
+
+# -------------------------------------------------- #
+# --- Store layout
+#
+# storePath/
+#   positions.npy   (T, N, 3) float32/float64
+#   cell.npy        (T, 3, 3) float64
+#   numbers.npy     (N,) int
+#   masses.npy      (N,) float64
+#   molID.npy       (N,) int (optional)
+#   meta.json       shape, dtype and pbc information
+
+STORE_VERSION = 1
+
+
+def write_traj_store(ase_db: Iterable[ase.ase.Atoms],
+                     storePath: str,
+                     n_frames: int = None,
+                     molIDs: np.ndarray = None,
+                     dtype: Union[str, np.dtype] = np.float32) -> str:
+    """Writes a trajectory once into a contiguous binary layout,
+    frame by frame, so the trajectory is never fully in memory.
+    The atoms number and order must be the same in all the frames.
+
+    :param ase_db: ase atoms database (or iterator, e.g., LazyTraj) of frames.
+    :type ase_db: Iterable[ase.ase.Atoms]
+    :param storePath: folder of the store.
+    :type storePath: str
+    :param n_frames: number of frames, defaults to None (i.e., len(ase_db))
+    :type n_frames: int, optional
+    :param molIDs: molecules IDs of the atoms, defaults to None
+    :type molIDs: np.ndarray, optional
+    :param dtype: positions dtype, defaults to np.float32
+    :type dtype: Union[str, np.dtype], optional
+    :raises ValueError: if the frames are not consistent.
+    :return: path of the store.
+    :rtype: str
+    """
+    if n_frames is None:
+        n_frames = len(ase_db)
+    dtype = np.dtype(dtype)
+    os.makedirs(storePath, exist_ok=True)
+    positions = None
+    for t, at in enumerate(tqdm(ase_db, total=n_frames, desc='Writing store')):
+        if t >= n_frames:
+            break
+        if positions is None:
+            n_atoms = len(at)
+            positions = np.lib.format.open_memmap(
+                os.path.join(storePath, 'positions.npy'), mode='w+',
+                dtype=dtype, shape=(n_frames, n_atoms, 3))
+            cell = np.lib.format.open_memmap(
+                os.path.join(storePath, 'cell.npy'), mode='w+',
+                dtype=np.float64, shape=(n_frames, 3, 3))
+            numbers = at.numbers.copy()
+            np.save(os.path.join(storePath, 'numbers.npy'), numbers)
+            np.save(os.path.join(storePath, 'masses.npy'), at.get_masses())
+            pbc = at.pbc.tolist()
+        elif len(at) != n_atoms or not np.array_equal(at.numbers, numbers):
+            raise ValueError(f"Frame {t} is not consistent with the first frame.")
+        positions[t] = at.positions
+        cell[t] = at.cell[:]
+    if positions is None:
+        raise ValueError("No frames to write.")
+    if t + 1 < n_frames:
+        raise ValueError(f"Only {t + 1} frames found, {n_frames} expected.")
+    positions.flush()
+    cell.flush()
+    if molIDs is not None:
+        np.save(os.path.join(storePath, 'molID.npy'), np.asarray(molIDs))
+    meta = dict(
+        version = STORE_VERSION,
+        n_frames = n_frames,
+        n_atoms = n_atoms,
+        dtype = dtype.name,
+        pbc = pbc
+    )
+    with open(os.path.join(storePath, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return storePath
+
+# -------------------------------------------------- #
+# --- Store reader
+
+class TrajStore:
+    """Memory-mapped columnar trajectory, written by `write_traj_store`.
+    Positions and cells are np.memmap arrays: slicing frames and atoms
+    is zero-copy and the pages are shared between processes.
+    Iterating (or indexing with an int) still gives ase.Atoms frames.
+    """
+
+    def __init__(self,
+                 storePath: str,
+                 frames: Union[slice, np.ndarray] = None,
+                 numbers: np.ndarray = None):
+        """
+        :param storePath: folder of the store.
+        :type storePath: str
+        :param frames: frames selection of the view, defaults to None (all)
+        :type frames: Union[slice, np.ndarray], optional
+        :param numbers: atomic numbers override, defaults to None (stored ones)
+        :type numbers: np.ndarray, optional
+        """
+        self.storePath = storePath
+        with open(os.path.join(storePath, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self._positions = np.load(os.path.join(storePath, 'positions.npy'),
+                                  mmap_mode='r')
+        self._cell = np.load(os.path.join(storePath, 'cell.npy'),
+                             mmap_mode='r')
+        self.numbers = np.load(os.path.join(storePath, 'numbers.npy'))
+        if numbers is not None:
+            self.numbers = np.asarray(numbers)
+        self.masses = np.load(os.path.join(storePath, 'masses.npy'))
+        molPath = os.path.join(storePath, 'molID.npy')
+        self.molIDs = np.load(molPath) if os.path.exists(molPath) else None
+        self._frames = slice(None) if frames is None else frames
+        pass
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Positions of the view, (T, N, 3) memmap (a copy for fancy frames selections).
+
+        :return: positions array.
+        :rtype: np.ndarray
+        """
+        return self._positions[self._frames]
+
+    @property
+    def cell(self) -> np.ndarray:
+        """Cells of the view, (T, 3, 3).
+
+        :return: cells array.
+        :rtype: np.ndarray
+        """
+        return self._cell[self._frames]
+
+    @property
+    def _frame_numbers(self) -> Union[range, np.ndarray]:
+        """Frames indexes (in the store) of the view.
+        """
+        if isinstance(self._frames, slice):
+            return range(len(self._cell))[self._frames]
+        return np.arange(len(self._cell))[self._frames]
+
+    def __len__(self) -> int:
+        return len(self._frame_numbers)
+
+    def __getitem__(self,
+                    key: Union[int, slice, list, np.ndarray]
+                    ) -> Union[ase.ase.Atoms, 'TrajStore']:
+        frames = self._frame_numbers
+        if not isinstance(key, (int, np.integer, slice)):
+            frames = np.asarray(frames)
+        selection = frames[key]
+        if isinstance(key, (int, np.integer)):
+            return self._to_atoms(selection)
+        if isinstance(selection, range):
+            # keeps the view as a slice, i.e., zero-copy
+            stop = selection.stop if selection.stop >= 0 else None
+            selection = slice(selection.start, stop, selection.step)
+        return TrajStore(self.storePath, frames=selection, numbers=self.numbers)
+
+    def with_numbers(self,
+                     numbers: np.ndarray) -> 'TrajStore':
+        """View of the same frames with the atomic numbers overridden
+        (e.g., Z shifted), nothing is written to the store.
+
+        :param numbers: atomic numbers, (N,).
+        :type numbers: np.ndarray
+        :return: trajectory view.
+        :rtype: TrajStore
+        """
+        return TrajStore(self.storePath, frames=self._frames, numbers=numbers)
+
+    def __iter__(self) -> Iterator[ase.ase.Atoms]:
+        for t in self._frame_numbers:
+            yield self._to_atoms(t)
+
+    def __repr__(self) -> str:
+        return f"TrajStore('{self.storePath}', frames={len(self)})"
+
+    def _to_atoms(self,
+                  t: int) -> ase.ase.Atoms:
+        """Builds the ase.Atoms of a single frame of the store.
+        """
+        at = Atoms(numbers=self.numbers,
+                   positions=self._positions[t],
+                   cell=self._cell[t],
+                   pbc=self.meta['pbc'])
+        if self.molIDs is not None:
+            at.arrays['molID'] = self.molIDs.copy()
+        return at
@@ -1,2 +1 @@
-from phdtools.computes import misc, data, traj, fes
-
+from phdtools.computes import misc, data, traj, fes, rdf, correlation, msd
@@ -0,0 +1,237 @@
+# -------------------------------------------------- #
+# Computes - time correlation functions module
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import numpy as np
+
+# -------------------------------------------------- #
+# --- FFT correlations
+
+def correlation_sum_fft(x: np.ndarray,
+                        y: np.ndarray = None,
+                        n_lags: int = None) -> np.ndarray:
+    """Sums over all time origins of x(t0) * y(t0 + m), along the first
+    axis and element-wise on the others, with zero padded FFTs.
+
+    :param x: time series, (T, ...).
+    :type x: np.ndarray
+    :param y: time series, defaults to None (autocorrelation)
+    :type y: np.ndarray, optional
+    :param n_lags: number of lags m, defaults to None (T)
+    :type n_lags: int, optional
+    :return: correlation sums, (n_lags, ...).
+    :rtype: np.ndarray
+    """
+    T = len(x)
+    n_lags = T if n_lags is None else min(n_lags, T)
+    Fx = np.fft.rfft(x, n=2 * T, axis=0)
+    Fy = Fx if y is None else np.fft.rfft(y, n=2 * T, axis=0)
+    return np.fft.irfft(Fx.conj() * Fy, n=2 * T, axis=0)[:n_lags]
+
+
+def correlation_fft(x: np.ndarray,
+                    y: np.ndarray = None) -> np.ndarray:
+    """All time origins correlation <x(t0) * y(t0 + m)>, along the first
+    axis and element-wise on the others, O(T log T).
+
+    :param x: time series, (T, ...).
+    :type x: np.ndarray
+    :param y: time series, defaults to None (autocorrelation)
+    :type y: np.ndarray, optional
+    :return: correlation, (T, ...).
+    :rtype: np.ndarray
+    """
+    T = len(x)
+    norm = (T - np.arange(T)).reshape((T,) + (1,) * (np.ndim(x) - 1))
+    return correlation_sum_fft(x, y) / norm
+
+
+def tcf_fft(X: np.ndarray,
+            Y: np.ndarray = None) -> np.ndarray:
+    """Time correlation function of each particle, <X(t0) . Y(t0 + t)>,
+    where the dot product is over the last axis (e.g., velocities for the
+    VACF, dipole unit vectors for the orientational correlation).
+
+    :param X: time series, (T, N, d), or (T, N) for scalar series.
+    :type X: np.ndarray
+    :param Y: time series, defaults to None (autocorrelation)
+    :type Y: np.ndarray, optional
+    :return: correlation per particle, (T, N).
+    :rtype: np.ndarray
+    """
+    X = _as_vectors(X)
+    Y = None if Y is None else _as_vectors(Y)
+    return np.sum(correlation_fft(X, Y), axis=-1)
+
+
+def _as_vectors(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=float)
+    return X[..., np.newaxis] if X.ndim == 2 else X
+
+
+def group_mean(C: np.ndarray,
+               molSym: list = None) -> dict:
+    """Averages per-particle correlations per molecule type.
+
+    :param C: correlation per particle, (T, N).
+    :type C: np.ndarray
+    :param molSym: molecule symbol of each particle, defaults to None (single group)
+    :type molSym: list, optional
+    :return: molecule symbol: (T,) correlation dictionary.
+    :rtype: dict
+    """
+    if molSym is None:
+        molSym = ['all'] * C.shape[1]
+    molSym = np.asarray(molSym)
+    return {str(mol): C[:, molSym == mol].mean(axis=1) for mol in np.unique(molSym)}
+
+# -------------------------------------------------- #
+# --- TCF
+
+class TCF:
+    """Time correlation functions (auto or cross) per molecule type,
+    e.g., VACF, orientational (dipole) or residence correlations.
+    """
+
+    def __init__(self,
+                 dt: float = 1.0,
+                 normalize: bool = False):
+        """
+        :param dt: time between frames, defaults to 1.0
+        :type dt: float, optional
+        :param normalize: divide by the value at t = 0, defaults to False
+        :type normalize: bool, optional
+        """
+        self.dt = dt
+        self.normalize = normalize
+        self.tcf_dict = None
+        pass
+
+    def fit(self,
+            X: np.ndarray,
+            molSym: list = None,
+            Y: np.ndarray = None) -> dict:
+        """Computes the all time origins correlation, averaged per molecule type.
+
+        :param X: time series, (T, N, d) or (T, N).
+        :type X: np.ndarray
+        :param molSym: molecule symbol of each particle, defaults to None (single group)
+        :type molSym: list, optional
+        :param Y: second time series (cross correlation), defaults to None
+        :type Y: np.ndarray, optional
+        :return: dictionary with `time` and the correlation of each group.
+        :rtype: dict
+        """
+        C = tcf_fft(X, Y)
+        self.tcf_dict = _finalize(group_mean(C, molSym), len(C),
+                                  self.dt, self.normalize)
+        return self.tcf_dict
+
+
+class StreamingTCF:
+    """Windowed time correlation functions for trajectories that do not
+    fit in memory: chunks of frames are fed in order (`partial_fit`) and
+    only the last `n_lags` - 1 frames are kept between chunks. The
+    result is the all time origins correlation up to `n_lags`, the same
+    as `TCF` on the whole trajectory.
+    """
+
+    def __init__(self,
+                 n_lags: int,
+                 dt: float = 1.0,
+                 normalize: bool = False,
+                 molSym: list = None):
+        """
+        :param n_lags: number of lags (window length).
+        :type n_lags: int
+        :param dt: time between frames, defaults to 1.0
+        :type dt: float, optional
+        :param normalize: divide by the value at t = 0, defaults to False
+        :type normalize: bool, optional
+        :param molSym: molecule symbol of each particle, defaults to None (single group)
+        :type molSym: list, optional
+        """
+        self.n_lags = n_lags
+        self.dt = dt
+        self.normalize = normalize
+        self.molSym = molSym
+        self.reset()
+        pass
+
+    def reset(self) -> None:
+        """Clears the accumulated frames.
+        """
+        self._sums = None
+        self._counts = np.zeros(self.n_lags)
+        self._bufX = None
+        self._bufY = None
+        pass
+
+    def partial_fit(self,
+                    X: np.ndarray,
+                    Y: np.ndarray = None) -> 'StreamingTCF':
+        """Accumulates the next chunk of frames.
+
+        :param X: time series chunk, (t, N, d) or (t, N).
+        :type X: np.ndarray
+        :param Y: second time series chunk (cross correlation), defaults to None
+        :type Y: np.ndarray, optional
+        :return: the accumulator itself.
+        :rtype: StreamingTCF
+        """
+        X = _as_vectors(X)
+        Y = None if Y is None else _as_vectors(Y)
+        if self._bufX is None:
+            self._bufX = X[:0]
+            self._bufY = None if Y is None else Y[:0]
+        # pairs within buffer + chunk, minus the ones within the buffer
+        ZX = np.concatenate([self._bufX, X])
+        ZY = None if Y is None else np.concatenate([self._bufY, Y])
+        sums = self._pad(np.sum(correlation_sum_fft(ZX, ZY, self.n_lags), axis=-1))
+        lags = np.arange(self.n_lags)
+        counts = np.clip(len(ZX) - lags, 0, None)
+        if len(self._bufX):
+            sums -= self._pad(np.sum(correlation_sum_fft(self._bufX, self._bufY,
+                                                         self.n_lags), axis=-1))
+            counts -= np.clip(len(self._bufX) - lags, 0, None)
+        self._sums = sums if self._sums is None else self._sums + sums
+        self._counts += counts
+        keep = self.n_lags - 1
+        self._bufX = ZX[len(ZX) - min(keep, len(ZX)):]
+        self._bufY = None if ZY is None else ZY[len(ZY) - min(keep, len(ZY)):]
+        return self
+
+    def _pad(self,
+             sums: np.ndarray) -> np.ndarray:
+        """Pads the sums of short chunks to n_lags.
+        """
+        pad = self.n_lags - len(sums)
+        if pad > 0:
+            sums = np.concatenate([sums, np.zeros((pad,) + sums.shape[1:])])
+        return sums
+
+    @property
+    def tcf_dict(self) -> dict:
+        """Correlation of the accumulated frames, lags without
+        time origins are NaN.
+
+        :return: dictionary with `time` and the correlation of each group.
+        :rtype: dict
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            C = self._sums / self._counts[:, np.newaxis]
+        return _finalize(group_mean(C, self.molSym), self.n_lags,
+                         self.dt, self.normalize)
+
+
+def _finalize(groups: dict,
+              n_lags: int,
+              dt: float,
+              normalize: bool) -> dict:
+    tcf_dict = dict(time = np.arange(n_lags) * dt)
+    for mol, C in groups.items():
+        tcf_dict[mol] = C / C[0] if normalize else C
+    return tcf_dict
@@ -6,73 +6,845 @@
 # -------------------------------------------------- #
 
 import numpy as np
-import random
-from typing import Union
+import functools
+from typing import Union, Tuple, Callable, Iterator
+
+# rows per block when streaming arrays larger than memory
+OOC_CHUNK_SIZE = 65536
+
+def random_indices(N: int,
+                   n: int=None,
+                   seed: Union[int, np.random.Generator]=None) -> np.ndarray:
+    """Draws n distinct random indexes out of N, in random order,
+    without permuting all the N indexes when n is small.
+
+    :param N: number of samples.
+    :type N: int
+    :param n: number of indexes, defaults to None (all, i.e., a permutation)
+    :type n: int, optional
+    :param seed: random seed or generator, defaults to None
+    :type seed: Union[int, np.random.Generator], optional
+    :return: indexes, (n,).
+    :rtype: np.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    if n is None or n >= N:
+        return rng.permutation(N)
+    return rng.choice(N, size=n, replace=False)
+
 
 def random_shuffle(X: np.ndarray, 
                    Y: np.ndarray=None, 
-                   n: int=None):
+                   n: int=None,
+                   seed: Union[int, np.random.Generator]=None,
+                   onlyNdx: bool=False):
     """Random shuffler for a dataset.
     Include also the possibility to shuffle a
     properties array in the same way.
+    Only the n drawn rows are read (X and Y can be memmaps),
+    `onlyNdx` returns the indexes instead of the copies.
+    """
+    l = random_indices(X.shape[0], n=n, seed=seed)
+    if onlyNdx:
+        return l
+    if Y is None:
+        return X[l]
+    else:
+        return X[l], Y[l]
+
+
+def train_test_split(X: np.ndarray,
+                     Y: np.ndarray=None,
+                     test_size: Union[int, float]=0.2,
+                     seed: Union[int, np.random.Generator]=None,
+                     onlyNdx: bool=False):
+    """Deterministic (given the seed) train/test split.
+    Only the test indexes are drawn, the train ones are the sorted
+    complement, so reading the train rows of a memmap is sequential.
+
+    :param X: samples, (N, ...).
+    :type X: np.ndarray
+    :param Y: properties, defaults to None
+    :type Y: np.ndarray, optional
+    :param test_size: test fraction (float) or number of samples (int), defaults to 0.2
+    :type test_size: Union[int, float], optional
+    :param seed: random seed or generator, defaults to None
+    :type seed: Union[int, np.random.Generator], optional
+    :param onlyNdx: return only the (train, test) indexes, defaults to False
+    :type onlyNdx: bool, optional
+    :return: X_train, X_test (, Y_train, Y_test), or the indexes.
+    :rtype: tuple
     """
-    l = np.arange(X.shape[0])
-    random.shuffle(l)
+    N = X.shape[0]
+    n_test = int(round(test_size * N)) if isinstance(test_size, float) else test_size
+    test = random_indices(N, n=n_test, seed=seed)
+    mask = np.ones(N, dtype=bool)
+    mask[test] = False
+    train = np.flatnonzero(mask)
+    if onlyNdx:
+        return train, test
     if Y is None:
-        return X[l[:n], :]
-    elif Y is None and n is None:
-        return X[l, :]
-    elif n is None:
-        return X[l, :], Y[l]
+        return X[train], X[test]
     else:
-        return X[l[:n], :], Y[l[:n]]
+        return X[train], X[test], Y[train], Y[test]
+
+
+def iter_rows(X: np.ndarray,
+              ndxs: np.ndarray,
+              chunk_size: int=OOC_CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """Streams the selected rows of X (e.g., a memmap) in chunks,
+    in the ndxs order, each chunk read with sorted indexes.
+
+    :param X: samples, (N, ...).
+    :type X: np.ndarray
+    :param ndxs: selected indexes.
+    :type ndxs: np.ndarray
+    :param chunk_size: rows per chunk, defaults to OOC_CHUNK_SIZE
+    :type chunk_size: int, optional
+    :yield: rows, (chunk_size, ...).
+    :rtype: Iterator[np.ndarray]
+    """
+    for b in range(0, len(ndxs), chunk_size):
+        chunk = ndxs[b:b + chunk_size]
+        order = np.argsort(chunk, kind='stable')
+        rows = np.empty((len(chunk),) + X.shape[1:], dtype=X.dtype)
+        rows[order] = X[chunk[order]]
+        yield rows
 
 
 def FPS(X: np.ndarray,
         n: int=-1, 
         ndx: int=None, 
-        retDist: bool=False):
+        retDist: bool=False,
+        dtype: Union[str, np.dtype]=np.float64,
+        chunk_size: int=None,
+        onlyNdx: bool=False):
     """Does Farthest Point Selection on a set of points X
     X is in the form of {X_i} with X_i(x_0,x_1,...,x_N)
     where N are the features or dimensions and i are the
     data sample size.
+    The squared norms are computed once and the distances from
+    each selected point are updated with a dot product,
+    |x - y|^2 = |x|^2 + |y|^2 - 2 x.y, over blocks of `chunk_size`
+    rows (multithreaded BLAS), in place into the min-distance buffer.
+    The rows are centered on the columns mean first, so the products
+    do not lose precision for data far from the origin; still, the
+    selection can differ from the explicit distances one on near ties
+    (within round off). float32 halves memory and time at the price
+    of precision.
+    X can also be larger than memory (np.memmap or any array-like
+    with row slicing): it is then streamed block by block at each
+    iteration and only the (N,) distances vectors are kept in memory,
+    use `onlyNdx` to get the indexes without the X[fps_ndxs] copy.
+    D[i] is the covering radius of the first i + 1 selected points.
     """
     N = X.shape[0]
     # if no n points are selected it takes all of them
     if n <= 0:
         n = N
+    if _in_memory(X):
+        # centered copy
+        Xc = np.asarray(X, dtype=dtype) - np.asarray(X, dtype=dtype).mean(axis=0)
+        mean = None
+        if chunk_size is None:
+            chunk_size = N
+    else:
+        # centered block by block
+        Xc = X
+        if chunk_size is None:
+            chunk_size = OOC_CHUNK_SIZE
+        mean = _column_mean(X, dtype, chunk_size)
 
     # init the arrays for the ndxs and distances
-    fps_ndxs = np.zeros(n, dtype=np.int)
+    fps_ndxs = np.zeros(n, dtype=int)
     D = np.zeros(n)
     if ndx is None:
         ndx = np.random.randint(0, N)
     fps_ndxs[0] = ndx
 
-    # compute the distance from selected point
-    dist1 = np.linalg.norm(X - X[ndx], axis=1)
+    # squared norms and squared distance from selected point
+    sq_norms = _sq_norms(Xc, dtype, chunk_size, mean)
+    min_d2 = np.full(N, np.inf, dtype=dtype)
+    buffer = np.empty(min(chunk_size, N), dtype=dtype)
+    _update_min_dist2(Xc, sq_norms, ndx, min_d2, buffer, mean)
+    # below this the distances are round off noise
+    tol = 8 * np.finfo(dtype).eps * sq_norms.max()
 
     # loop over the remaining points
     for i in range(1, n):
         # get and store the index for the max dist from the point chosen
-        fps_ndxs[i] = np.argmax(dist1)
-        D[i - 1] = np.amax(dist1)
+        fps_ndxs[i] = np.argmax(min_d2)
+        D[i - 1] = np.sqrt(min_d2[fps_ndxs[i]])
 
-        # compute the dists from the newly selected point
-        dist2 = np.linalg.norm(X - X[fps_ndxs[i]], axis=1)
-        # takes the min from the two arrays dist1 2
-        dist1 = np.minimum(dist1, dist2)
+        # takes the min with the dists from the newly selected point
+        _update_min_dist2(Xc, sq_norms, fps_ndxs[i], min_d2, buffer, mean)
 
         # little stopping condition
-        if np.abs(dist1).max() == 0.0:
-            print(f"Only {i} iteration possible")
-            return fps_ndxs[:i], D[:i]
+        if min_d2.max() <= tol:
+            print(f"Only {i + 1} iteration possible")
+            fps_ndxs, D = fps_ndxs[:i + 1], D[:i + 1]
+            break
+    else:
+        # covering radius of the whole selection
+        D[n - 1] = np.sqrt(min_d2.max())
 
+    if onlyNdx:
+        return (fps_ndxs, D) if retDist else fps_ndxs
     if retDist:
         return X[fps_ndxs], fps_ndxs, D
     else:
         return X[fps_ndxs], fps_ndxs
 
+
+def approx_FPS(X: np.ndarray,
+               n: int,
+               n_buckets: int=16,
+               n_coarse: int=None,
+               retDist: bool=False,
+               dtype: Union[str, np.dtype]=np.float64,
+               chunk_size: int=None,
+               seed: Union[int, np.random.Generator]=None,
+               onlyNdx: bool=False):
+    """Approximate (hierarchical) Farthest Point Selection:
+    a coarse FPS on a random subsample of `n_coarse` points
+    (drawn with `seed`) gives `n_buckets` centers, every point goes
+    to the bucket of its closest center and an exact FPS is run
+    within each bucket, seeded by the member closest to the center.
+    Every non-empty bucket gets at least one point, the rest are
+    proportional to the bucket size.
+    The cost is about n * N / n_buckets instead of n * N, i.e.,
+    `n_buckets` trades accuracy for speed (1 is the exact FPS).
+    A small subsample can miss small clusters, which then only
+    get the points of the bucket they fall in.
+    With `retDist` the covering radius of the selection is returned,
+    the max distance of any point from the selected ones, to compare
+    with the exact FPS D[-1].
+    """
+    N = X.shape[0]
+    n = min(n, N)
+    n_buckets = max(1, min(n_buckets, n))
+    if chunk_size is None:
+        chunk_size = N if _in_memory(X) else OOC_CHUNK_SIZE
+    if n_coarse is None:
+        n_coarse = min(N, 100 * n_buckets)
+    rng = np.random.default_rng(seed)
+    mean = _column_mean(X, dtype, chunk_size)
+
+    # coarse FPS centers on a random subsample
+    sub = np.sort(rng.choice(N, size=n_coarse, replace=False))
+    centers = np.asarray(X[sub], dtype=dtype)
+    centers = centers[FPS(centers, n=n_buckets, ndx=rng.integers(n_coarse),
+                          dtype=dtype, onlyNdx=True)]
+    buckets, _ = _nearest_center(X, centers, dtype, chunk_size, mean)
+
+    # points per bucket, at least one per non-empty bucket
+    sizes = np.bincount(buckets, minlength=len(centers))
+    quotas = _split_quotas(n, sizes)
+
+    fps_ndxs = list()
+    for b in np.flatnonzero(quotas):
+        members = np.flatnonzero(buckets == b)
+        Xb = np.asarray(X[members], dtype=dtype)
+        first = np.argmin(np.einsum('ij,ij->i', Xb - centers[b], Xb - centers[b]))
+        fps_ndxs.append(members[FPS(Xb, n=quotas[b], ndx=first,
+                                    dtype=dtype, onlyNdx=True)])
+    fps_ndxs = np.concatenate(fps_ndxs)
+
+    if retDist:
+        _, min_d2 = _nearest_center(X, X[fps_ndxs], dtype, chunk_size, mean)
+        radius = np.sqrt(min_d2.max())
+    if onlyNdx:
+        return (fps_ndxs, radius) if retDist else fps_ndxs
+    if retDist:
+        return X[fps_ndxs], fps_ndxs, radius
+    else:
+        return X[fps_ndxs], fps_ndxs
+
+
+class IncrementalFPS:
+    """Resumable Farthest Point Selection: the state (selected
+    indexes and points, min-distance vector) is kept between calls,
+    so a selection can be extended with more points and/or over a
+    grown dataset (new rows appended to X), and saved to disk.
+    Only the new rows are compared with the previous selection, so
+    growing the dataset by 1% costs about 1% of the compute.
+    """
+
+    def __init__(self,
+                 dtype: Union[str, np.dtype]=np.float64,
+                 chunk_size: int=None):
+        """
+        :param dtype: distances dtype, defaults to np.float64
+        :type dtype: Union[str, np.dtype], optional
+        :param chunk_size: rows per block, defaults to None (all or OOC_CHUNK_SIZE)
+        :type chunk_size: int, optional
+        """
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.reset()
+        pass
+
+    def reset(self) -> None:
+        """Clears the selection.
+        """
+        self.fps_ndxs = np.zeros(0, dtype=int)
+        self.D = np.zeros(0)
+        self.selected = None
+        self.min_d2 = np.zeros(0, dtype=self.dtype)
+        self.sq_norms = np.zeros(0, dtype=self.dtype)
+        # centering of the norms and products, fixed by the first rows
+        self.mean = None
+        pass
+
+    @property
+    def n_seen(self) -> int:
+        """Number of rows of X already in the state.
+
+        :return: rows.
+        :rtype: int
+        """
+        return len(self.min_d2)
+
+    @property
+    def radius(self) -> float:
+        """Covering radius of the selection on the seen rows.
+
+        :return: max min-distance.
+        :rtype: float
+        """
+        return np.sqrt(self.min_d2.max()) if self.n_seen else np.inf
+
+    def fit(self,
+            X: np.ndarray,
+            n: int,
+            ndx: int=None) -> np.ndarray:
+        """Selects n points from scratch, as `FPS`.
+
+        :param X: points, (N, D).
+        :type X: np.ndarray
+        :param n: number of points.
+        :type n: int
+        :param ndx: first point, defaults to None (random)
+        :type ndx: int, optional
+        :return: selected indexes.
+        :rtype: np.ndarray
+        """
+        self.reset()
+        return self.extend(X, n, ndx=ndx)
+
+    def extend(self,
+               X: np.ndarray,
+               n: int,
+               ndx: int=None) -> np.ndarray:
+        """Selects n more points. X is the whole dataset: the rows
+        beyond `n_seen` are new points, added to the state first.
+
+        :param X: points, (N, D), with the seen rows first and unchanged.
+        :type X: np.ndarray
+        :param n: number of points to add to the selection.
+        :type n: int
+        :param ndx: first point if the selection is empty, defaults to None (random)
+        :type ndx: int, optional
+        :raises ValueError: if X has less rows than already seen.
+        :return: all the selected indexes.
+        :rtype: np.ndarray
+        """
+        N = X.shape[0]
+        if N < self.n_seen:
+            raise ValueError(f"X has {N} rows, {self.n_seen} already seen.")
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = N if _in_memory(X) else OOC_CHUNK_SIZE
+        self._add_rows(X, chunk_size)
+
+        new_ndxs = list()
+        new_D = list()
+        buffer = np.empty(min(chunk_size, N), dtype=self.dtype)
+        if not len(self.fps_ndxs) and n > 0:
+            if ndx is None:
+                ndx = np.random.randint(0, N)
+            _update_min_dist2(X, self.sq_norms, ndx, self.min_d2, buffer, self.mean)
+            new_ndxs.append(ndx)
+            n -= 1
+        tol = 8 * np.finfo(self.dtype).eps * self.sq_norms.max()
+        for _ in range(n):
+            j = np.argmax(self.min_d2)
+            if self.min_d2[j] <= tol:
+                print(f"Only {len(self.fps_ndxs) + len(new_ndxs)} iteration possible")
+                break
+            new_D.append(np.sqrt(self.min_d2[j]))
+            _update_min_dist2(X, self.sq_norms, j, self.min_d2, buffer, self.mean)
+            new_ndxs.append(j)
+
+        if new_ndxs:
+            new_ndxs = np.array(new_ndxs, dtype=int)
+            new_sel = np.asarray(X[new_ndxs], dtype=self.dtype)
+            self.selected = new_sel if self.selected is None \
+                else np.concatenate([self.selected, new_sel])
+            self.fps_ndxs = np.concatenate([self.fps_ndxs, new_ndxs])
+        # D[i] is the covering radius of the first i + 1 points
+        self.D = np.concatenate([self.D[:-1], new_D, [self.radius]])
+        return self.fps_ndxs
+
+    def _add_rows(self,
+                  X: np.ndarray,
+                  chunk_size: int) -> None:
+        """Norms of the new rows and their distances from the selection.
+        """
+        Xnew = X[self.n_seen:]
+        if not Xnew.shape[0]:
+            return
+        if self.mean is None:
+            self.mean = _column_mean(Xnew, self.dtype, chunk_size)
+        sq_norms = _sq_norms(Xnew, self.dtype, chunk_size, self.mean)
+        if self.selected is None:
+            min_d2 = np.full(Xnew.shape[0], np.inf, dtype=self.dtype)
+        else:
+            _, min_d2 = _nearest_center(Xnew, self.selected, self.dtype,
+                                        chunk_size, self.mean)
+        self.sq_norms = np.concatenate([self.sq_norms, sq_norms])
+        self.min_d2 = np.concatenate([self.min_d2, min_d2])
+        pass
+
+    def save(self,
+             path: str) -> None:
+        """Saves the state to a npz file (written at `path` as is,
+        no extension is added).
+
+        :param path: file path.
+        :type path: str
+        """
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     fps_ndxs=self.fps_ndxs,
+                     D=self.D,
+                     selected=np.zeros((0, 0), dtype=self.dtype) if self.selected is None else self.selected,
+                     min_d2=self.min_d2,
+                     sq_norms=self.sq_norms,
+                     mean=np.zeros(0, dtype=self.dtype) if self.mean is None else self.mean)
+        pass
+
+    @classmethod
+    def load(cls,
+             path: str,
+             chunk_size: int=None) -> 'IncrementalFPS':
+        """Restores a state saved with `save`.
+
+        :param path: file path.
+        :type path: str
+        :param chunk_size: rows per block, defaults to None
+        :type chunk_size: int, optional
+        :return: resumable selection.
+        :rtype: IncrementalFPS
+        """
+        with np.load(path) as npz:
+            fps = cls(dtype=npz['min_d2'].dtype, chunk_size=chunk_size)
+            fps.fps_ndxs = npz['fps_ndxs']
+            fps.D = npz['D']
+            fps.selected = npz['selected'] if npz['selected'].size else None
+            fps.min_d2 = npz['min_d2']
+            fps.sq_norms = npz['sq_norms']
+            fps.mean = npz['mean'] if npz['mean'].size else None
+        return fps
+
+    @classmethod
+    def from_selection(cls,
+                       X: np.ndarray,
+                       fps_ndxs: np.ndarray,
+                       dtype: Union[str, np.dtype]=np.float64,
+                       chunk_size: int=None) -> 'IncrementalFPS':
+        """Builds the state of a previous selection (e.g., from `FPS`),
+        computing its min-distance vector on X.
+
+        :param X: points, (N, D).
+        :type X: np.ndarray
+        :param fps_ndxs: selected indexes.
+        :type fps_ndxs: np.ndarray
+        :param dtype: distances dtype, defaults to np.float64
+        :type dtype: Union[str, np.dtype], optional
+        :param chunk_size: rows per block, defaults to None
+        :type chunk_size: int, optional
+        :return: resumable selection.
+        :rtype: IncrementalFPS
+        """
+        fps = cls(dtype=dtype, chunk_size=chunk_size)
+        fps.fps_ndxs = np.asarray(fps_ndxs, dtype=int)
+        fps.selected = np.asarray(X[fps.fps_ndxs], dtype=fps.dtype)
+        fps._add_rows(X, chunk_size or (X.shape[0] if _in_memory(X) else OOC_CHUNK_SIZE))
+        fps.min_d2[fps.fps_ndxs] = 0
+        fps.D = np.full(len(fps.fps_ndxs), np.nan)
+        fps.D[-1] = fps.radius
+        return fps
+
+
+def soap_kernel(A: np.ndarray,
+                B: np.ndarray,
+                zeta: int=2) -> np.ndarray:
+    """Normalized dot product (SOAP) kernel, (a.b / |a||b|)^zeta.
+    With a non integer zeta the negative cosines are clipped to 0.
+
+    :param A: descriptors, (m, D).
+    :type A: np.ndarray
+    :param B: descriptors, (k, D).
+    :type B: np.ndarray
+    :param zeta: kernel exponent, defaults to 2
+    :type zeta: int, optional
+    :raises ValueError: if a descriptor has zero norm.
+    :return: kernel matrix, (m, k).
+    :rtype: np.ndarray
+    """
+    normA = np.linalg.norm(A, axis=1, keepdims=True)
+    normB = np.linalg.norm(B, axis=1, keepdims=True)
+    if not (np.all(normA > 0) and np.all(normB > 0)):
+        raise ValueError("Zero norm descriptors have no SOAP kernel.")
+    A = A / normA
+    B = B / normB
+    return _soap_power(A @ B.T, zeta)
+
+
+def _soap_power(cos: np.ndarray,
+                zeta: Union[int, float]) -> np.ndarray:
+    """In place cos^zeta, clipping the negative cosines for a non integer zeta.
+    """
+    if float(zeta) != int(zeta):
+        np.maximum(cos, 0, out=cos)
+    np.power(cos, zeta, out=cos)
+    return cos
+
+
+def kernel_FPS(X: np.ndarray,
+               n: int=-1,
+               ndx: int=None,
+               kernel: Callable=None,
+               zeta: int=2,
+               diag: Union[Callable, np.ndarray]=None,
+               retDist: bool=False,
+               dtype: Union[str, np.dtype]=np.float64,
+               chunk_size: int=None,
+               onlyNdx: bool=False):
+    """Farthest Point Selection in the metric induced by a kernel,
+    d(x, y)^2 = k(x, x) + k(y, y) - 2 k(x, y), with the distances
+    from each selected point computed over blocks of rows, as `FPS`.
+    The default kernel is the SOAP one (`soap_kernel` with `zeta`):
+    the inverse norms are computed once and each update is a single
+    dot product with the selected row, in place into a buffer.
+    Any kernel(A, B) -> (len(A), len(B)) matrix function can be used,
+    together with its `diag`, k(x, x) of all the rows, as an (N,) array
+    or a vectorized diag(block) -> (len(block),) function.
+    Same arguments and outputs as `FPS`.
+    """
+    N = X.shape[0]
+    if n <= 0:
+        n = N
+    if _in_memory(X):
+        Xc = np.ascontiguousarray(X, dtype=dtype)
+        if chunk_size is None:
+            chunk_size = N
+    else:
+        Xc = X
+        if chunk_size is None:
+            chunk_size = OOC_CHUNK_SIZE
+    if kernel is None:
+        sq_norms = _sq_norms(Xc, dtype, chunk_size)
+        if not np.all(sq_norms > 0):
+            raise ValueError(f"Zero norm rows (e.g., {np.flatnonzero(sq_norms <= 0)[:5]}) "
+                             "have no SOAP kernel, remove them first.")
+        inv_norms = 1 / np.sqrt(sq_norms)
+        buffer = np.empty(min(chunk_size, N), dtype=dtype)
+        update = functools.partial(_update_min_soap_dist2, Xc, inv_norms,
+                                   zeta=zeta, buffer=buffer)
+        diag = np.ones(N, dtype=dtype)
+    else:
+        if diag is None:
+            raise ValueError("A custom kernel needs its `diag`, an (N,) array "
+                             "or a vectorized diag(block) function.")
+        if callable(diag):
+            diag_fn, diag = diag, np.empty(N, dtype=dtype)
+            for b in range(0, N, chunk_size):
+                diag[b:b + chunk_size] = diag_fn(np.asarray(Xc[b:b + chunk_size], dtype=dtype))
+        diag = np.asarray(diag, dtype=dtype)
+        update = functools.partial(_update_min_kernel_dist2, Xc, diag,
+                                   kernel=kernel, dtype=dtype, chunk_size=chunk_size)
+
+    fps_ndxs = np.zeros(n, dtype=int)
+    D = np.zeros(n)
+    if ndx is None:
+        ndx = np.random.randint(0, N)
+    fps_ndxs[0] = ndx
+    min_d2 = np.full(N, np.inf, dtype=dtype)
+    update(ndx, min_d2)
+    tol = 8 * np.finfo(dtype).eps * diag.max()
+
+    for i in range(1, n):
+        fps_ndxs[i] = np.argmax(min_d2)
+        D[i - 1] = np.sqrt(min_d2[fps_ndxs[i]])
+        update(fps_ndxs[i], min_d2)
+        if min_d2.max() <= tol:
+            print(f"Only {i + 1} iteration possible")
+            fps_ndxs, D = fps_ndxs[:i + 1], D[:i + 1]
+            break
+    else:
+        D[n - 1] = np.sqrt(min_d2.max())
+
+    if onlyNdx:
+        return (fps_ndxs, D) if retDist else fps_ndxs
+    if retDist:
+        return X[fps_ndxs], fps_ndxs, D
+    else:
+        return X[fps_ndxs], fps_ndxs
+
+
+def randomized_svd(X: np.ndarray,
+                   k: int,
+                   n_oversample: int=10,
+                   n_iter: int=2,
+                   dtype: Union[str, np.dtype]=np.float64,
+                   chunk_size: int=None,
+                   seed: Union[int, np.random.Generator]=None
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Truncated SVD of X with random projections (Halko et al.),
+    X is only accessed through products over blocks of rows,
+    so it can be a np.memmap larger than memory.
+
+    :param X: matrix, (N, D).
+    :type X: np.ndarray
+    :param k: rank.
+    :type k: int
+    :param n_oversample: extra random vectors, defaults to 10
+    :type n_oversample: int, optional
+    :param n_iter: power iterations, defaults to 2
+    :type n_iter: int, optional
+    :param dtype: computation dtype, defaults to np.float64
+    :type dtype: Union[str, np.dtype], optional
+    :param chunk_size: rows per block, defaults to None
+    :type chunk_size: int, optional
+    :param seed: random seed or generator, defaults to None
+    :type seed: Union[int, np.random.Generator], optional
+    :return: U (N, k), s (k,), Vt (k, D).
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    N, D = X.shape
+    if chunk_size is None:
+        chunk_size = N if _in_memory(X) else OOC_CHUNK_SIZE
+    rng = np.random.default_rng(seed)
+    l = min(k + n_oversample, N, D)
+
+    def X_dot(M):
+        out = np.empty((N, M.shape[1]), dtype=dtype)
+        for b in range(0, N, chunk_size):
+            out[b:b + chunk_size] = np.asarray(X[b:b + chunk_size], dtype=dtype) @ M
+        return out
+
+    def Xt_dot(M):
+        out = np.zeros((D, M.shape[1]), dtype=dtype)
+        for b in range(0, N, chunk_size):
+            out += np.asarray(X[b:b + chunk_size], dtype=dtype).T @ M[b:b + chunk_size]
+        return out
+
+    Q, _ = np.linalg.qr(X_dot(rng.standard_normal((D, l)).astype(dtype)))
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(Xt_dot(Q))
+        Q, _ = np.linalg.qr(X_dot(Q))
+    # B = Q^T X, (l, D)
+    Ub, s, Vt = np.linalg.svd(Xt_dot(Q).T, full_matrices=False)
+    return (Q @ Ub)[:, :k], s[:k], Vt[:k]
+
+
+def CUR(X: np.ndarray,
+        n: int,
+        k: int=None,
+        mode: str='top',
+        retScores: bool=False,
+        dtype: Union[str, np.dtype]=np.float64,
+        chunk_size: int=None,
+        seed: Union[int, np.random.Generator]=None,
+        onlyNdx: bool=False):
+    """CUR rows selection by statistical leverage scores,
+    pi_i = sum_j U_ij^2 / k on the top k left singular vectors
+    of X, from a block streamed `randomized_svd`.
+    The rows are the n with the highest scores (`mode='top'`) or
+    sampled without replacement with probability pi (`mode='sample'`).
+    Same outputs as `FPS`, `retScores` gives the selected scores.
+    """
+    N = X.shape[0]
+    n = min(n, N)
+    if k is None:
+        k = min(n, X.shape[1])
+    rng = np.random.default_rng(seed)
+    U, _, _ = randomized_svd(X, k, dtype=dtype, chunk_size=chunk_size, seed=rng)
+    scores = np.einsum('ij,ij->i', U, U) / k
+    if mode == 'top':
+        ndxs = np.argsort(-scores, kind='stable')[:n]
+    elif mode == 'sample':
+        ndxs = rng.choice(N, size=n, replace=False, p=scores / scores.sum())
+    else:
+        raise ValueError(f"Unknown mode '{mode}', use 'top' or 'sample'.")
+
+    if onlyNdx:
+        return (ndxs, scores[ndxs]) if retScores else ndxs
+    if retScores:
+        return X[ndxs], ndxs, scores[ndxs]
+    else:
+        return X[ndxs], ndxs
+
+
+def _nearest_center(X: np.ndarray,
+                    centers: np.ndarray,
+                    dtype: Union[str, np.dtype],
+                    chunk_size: int,
+                    mean: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of, and squared distance from, the closest center
+    of each row of X, block by block (rows and centers centered
+    on mean, if given).
+    """
+    centers = np.asarray(centers, dtype=dtype)
+    if mean is not None:
+        centers = centers - mean
+    c_norms = np.einsum('ij,ij->i', centers, centers)
+    labels = np.empty(X.shape[0], dtype=int)
+    min_d2 = np.empty(X.shape[0], dtype=dtype)
+    # bounds the (block, n_centers) temporary
+    chunk_size = min(chunk_size, max(1, OOC_CHUNK_SIZE * 64 // len(centers)))
+    for b in range(0, X.shape[0], chunk_size):
+        block = _block(X, b, chunk_size, dtype, mean)
+        d2 = c_norms - 2 * block @ centers.T
+        labels[b:b + chunk_size] = np.argmin(d2, axis=1)
+        d2 = d2[np.arange(len(block)), labels[b:b + chunk_size]]
+        min_d2[b:b + chunk_size] = np.maximum(d2 + np.einsum('ij,ij->i', block, block), 0)
+    return labels, min_d2
+
+
+def _split_quotas(n: int,
+                  sizes: np.ndarray) -> np.ndarray:
+    """Splits n points proportionally to the buckets sizes
+    (largest remainders), with at least one point per non-empty
+    bucket (n must be at least their number) and without exceeding
+    any bucket size.
+    """
+    quotas = np.minimum(np.floor(n * sizes / sizes.sum()).astype(int), sizes)
+    quotas[(sizes > 0) & (quotas == 0)] = 1
+    # take the excess back from the largest quotas
+    while quotas.sum() > n:
+        quotas[np.argmax(quotas)] -= 1
+    while quotas.sum() < n:
+        room = sizes - quotas
+        share = n * sizes / sizes.sum() - quotas
+        share[room == 0] = -np.inf
+        quotas[np.argmax(share)] += 1
+    return quotas
+
+
+def _in_memory(X: np.ndarray) -> bool:
+    """True for plain in memory arrays (not memmaps or stores).
+    """
+    return isinstance(X, np.ndarray) and not isinstance(X, np.memmap)
+
+
+def _column_mean(X: np.ndarray,
+                 dtype: Union[str, np.dtype],
+                 chunk_size: int) -> np.ndarray:
+    """Mean of the columns of X, block by block.
+    """
+    total = np.zeros(X.shape[1], dtype=np.float64)
+    for b in range(0, X.shape[0], chunk_size):
+        total += np.asarray(X[b:b + chunk_size], dtype=np.float64).sum(axis=0)
+    return (total / X.shape[0]).astype(dtype)
+
+
+def _block(X: np.ndarray,
+           b: int,
+           chunk_size: int,
+           dtype: Union[str, np.dtype],
+           mean: np.ndarray = None) -> np.ndarray:
+    """Rows block of X, in dtype and centered on mean (if given).
+    """
+    block = np.asarray(X[b:b + chunk_size], dtype=dtype)
+    return block if mean is None else block - mean
+
+
+def _sq_norms(X: np.ndarray,
+              dtype: Union[str, np.dtype],
+              chunk_size: int,
+              mean: np.ndarray = None) -> np.ndarray:
+    """Squared norms of the (centered) rows of X, block by block.
+    """
+    sq_norms = np.empty(X.shape[0], dtype=dtype)
+    for b in range(0, X.shape[0], chunk_size):
+        block = _block(X, b, chunk_size, dtype, mean)
+        sq_norms[b:b + chunk_size] = np.einsum('ij,ij->i', block, block)
+    return sq_norms
+
+
+def _update_min_soap_dist2(X: np.ndarray,
+                           inv_norms: np.ndarray,
+                           ndx: int,
+                           min_d2: np.ndarray,
+                           zeta: Union[int, float],
+                           buffer: np.ndarray) -> None:
+    """In place min between the squared SOAP distances buffer and
+    the squared SOAP distances from X[ndx], 2 - 2 k, block by block.
+    """
+    x = np.asarray(X[ndx], dtype=buffer.dtype)
+    chunk_size = len(buffer)
+    for b in range(0, X.shape[0], chunk_size):
+        block = np.asarray(X[b:b + chunk_size], dtype=buffer.dtype)
+        k = buffer[:len(block)]
+        np.dot(block, x, out=k)
+        k *= inv_norms[b:b + chunk_size]
+        k *= inv_norms[ndx]
+        _soap_power(k, zeta)
+        k *= -2
+        k += 2
+        np.maximum(k, 0, out=k)
+        np.minimum(min_d2[b:b + chunk_size], k, out=min_d2[b:b + chunk_size])
+    min_d2[ndx] = 0
+    pass
+
+
+def _update_min_kernel_dist2(X: np.ndarray,
+                             diag: np.ndarray,
+                             ndx: int,
+                             min_d2: np.ndarray,
+                             kernel: Callable,
+                             dtype: Union[str, np.dtype],
+                             chunk_size: int) -> None:
+    """In place min between the squared kernel distances buffer
+    and the squared kernel distances from X[ndx], block by block.
+    """
+    x = np.asarray(X[ndx], dtype=dtype)[np.newaxis]
+    for b in range(0, X.shape[0], chunk_size):
+        block = np.asarray(X[b:b + chunk_size], dtype=dtype)
+        d2 = diag[b:b + chunk_size] + diag[ndx] - 2 * kernel(block, x)[:, 0]
+        np.maximum(d2, 0, out=d2)
+        np.minimum(min_d2[b:b + chunk_size], d2, out=min_d2[b:b + chunk_size])
+    min_d2[ndx] = 0
+    pass
+
+
+def _update_min_dist2(X: np.ndarray,
+                      sq_norms: np.ndarray,
+                      ndx: int,
+                      min_d2: np.ndarray,
+                      buffer: np.ndarray,
+                      mean: np.ndarray = None) -> None:
+    """In place min between the squared distances buffer and
+    the squared distances from X[ndx], block by block
+    (rows centered on mean, if given, as the norms).
+    """
+    x = _block(X, ndx, 1, buffer.dtype, mean)[0]
+    chunk_size = len(buffer)
+    for b in range(0, X.shape[0], chunk_size):
+        block = _block(X, b, chunk_size, buffer.dtype, mean)
+        d2 = buffer[:len(block)]
+        np.dot(block, x, out=d2)
+        d2 *= -2
+        d2 += sq_norms[b:b + chunk_size]
+        d2 += sq_norms[ndx]
+        np.maximum(d2, 0, out=d2)
+        np.minimum(min_d2[b:b + chunk_size], d2, out=min_d2[b:b + chunk_size])
+    min_d2[ndx] = 0
+    pass
+
 # there is a bug, so it has been removed
 # def normalizeData(X: np.ndarray, 
 #                   mean: Union[int, np.ndarray, ]=None, 
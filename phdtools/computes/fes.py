@@ -6,6 +6,8 @@
 # -------------------------------------------------- #
 
 import numpy as np
+import itertools
+from scipy.signal import fftconvolve
 # import phdtools.plots as phdplot
 from typing import Union, List
 from phdtools.computes import misc
@@ -164,6 +166,132 @@ def mesh_grid_2d(X: np.ndarray,
     
     return XX, YY
 
+
+def _fixed_edges(bins: Union[int, list, np.ndarray],
+                 range: (float, float),
+                 dim: int) -> list:
+    """Bins edges of each CV, from the number of bins (one for
+    all CVs or one per CV) and the range, or from edges arrays.
+    Numbers and edges can be mixed, one entry per CV.
+    """
+    if bins is None:
+        raise ValueError("Fixed bins are needed: give `bins` and `range`, "
+                         "or the bins edges.")
+    if isinstance(bins, (int, np.integer)):
+        bins = [bins] * dim
+    elif all(np.ndim(b) == 0 for b in bins) and not (
+            (len(bins) == dim or dim > 1) and
+            all(isinstance(b, (int, np.integer)) for b in bins)):
+        # a single edges array
+        bins = [bins]
+    if len(bins) != dim:
+        raise ValueError(f"{len(bins)} bins given for {dim} CVs.")
+    if any(isinstance(b, (int, np.integer)) for b in bins):
+        if range is None:
+            raise ValueError("A `range` is needed with a number of bins.")
+        ranges = [range] * dim if np.ndim(range) == 1 else list(range)
+        if len(ranges) != dim:
+            raise ValueError(f"{len(ranges)} ranges given for {dim} CVs.")
+    edges = list()
+    for i, b in enumerate(bins):
+        if isinstance(b, (int, np.integer)):
+            lo, hi = ranges[i]
+            edges.append(np.linspace(lo, hi, b + 1))
+        else:
+            edges.append(np.asarray(b, dtype=float))
+    return edges
+
+
+def colvar_chunks(filename: str,
+                  columns: List[int],
+                  chunk_size: int =1000000) -> np.ndarray:
+    """Reads a (PLUMED) COLVAR file in chunks of rows,
+    skipping the comments (#) lines.
+
+    :param filename: COLVAR file.
+    :type filename: str
+    :param columns: columns to read.
+    :type columns: List[int]
+    :param chunk_size: rows per chunk, defaults to 1000000
+    :type chunk_size: int, optional
+    :yield: chunk, (chunk_size, len(columns)).
+    :rtype: np.ndarray
+    """
+    with open(filename, 'r') as f:
+        lines = (l for l in f if l.strip() and not l.startswith('#'))
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            yield np.loadtxt(chunk, usecols=columns, ndmin=2)
+
+def kde_bandwidth(sample: np.ndarray,
+                  method: str ='scott',
+                  weights: np.ndarray =None) -> np.ndarray:
+    """Gaussian KDE bandwidth of each CV, from the (weighted)
+    standard deviation and the effective samples number.
+
+    :param sample: CVs, (n, d).
+    :type sample: np.ndarray
+    :param method: 'scott' or 'silverman', defaults to 'scott'
+    :type method: str, optional
+    :param weights: samples weights, defaults to None
+    :type weights: np.ndarray, optional
+    :raises ValueError: if the method is unknown.
+    :return: bandwidths, (d,).
+    :rtype: np.ndarray
+    """
+    n, d = sample.shape
+    w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    n_eff = w.sum() ** 2 / np.sum(w ** 2)
+    mean = np.average(sample, axis=0, weights=w)
+    std = np.sqrt(np.average((sample - mean) ** 2, axis=0, weights=w))
+    if method == 'scott':
+        factor = n_eff ** (-1. / (d + 4))
+    elif method == 'silverman':
+        factor = (n_eff * (d + 2) / 4.) ** (-1. / (d + 4))
+    else:
+        raise ValueError(f"Unknown bandwidth method '{method}', "
+                         "use 'scott', 'silverman' or a number.")
+    return factor * std
+
+
+def binned_kde(sample: np.ndarray,
+               edges: list,
+               bandwidth: np.ndarray,
+               weights: np.ndarray =None) -> np.ndarray:
+    """Binned Gaussian KDE: the (weighted) histogram is convolved with
+    a Gaussian kernel, one CV at a time with FFTs, so the cost scales
+    with the bins and not with samples x grid points.
+    The bins must be uniform.
+
+    :param sample: CVs, (n, d).
+    :type sample: np.ndarray
+    :param edges: bins edges of each CV.
+    :type edges: list
+    :param bandwidth: kernel standard deviation of each CV, (d,).
+    :type bandwidth: np.ndarray
+    :param weights: samples weights, defaults to None
+    :type weights: np.ndarray, optional
+    :return: density on the bins, as np.histogramdd(..., density=True).
+    :rtype: np.ndarray
+    """
+    density, _ = np.histogramdd(sample, bins=edges, weights=weights)
+    widths = [e[1] - e[0] for e in edges]
+    for axis, (h, width) in enumerate(zip(bandwidth, widths)):
+        sigma = h / width
+        if sigma <= 0:
+            continue
+        half = int(np.ceil(4 * sigma))
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) / sigma) ** 2)
+        shape = [1] * density.ndim
+        shape[axis] = -1
+        density = fftconvolve(density, (kernel / kernel.sum()).reshape(shape),
+                              mode='same', axes=axis)
+    # FFT round off
+    density = np.clip(density, 0, None)
+    return density / (density.sum() * np.prod(widths))
+
 # ---
 
 class FES(BaseFES):
@@ -178,8 +306,116 @@ class FES(BaseFES):
                  units: str = 'kb'):
         super().__init__(temperature, units)
         self.fes_dict = None
+        self.reset()
         pass
 
+    # --- accumulator mode
+
+    def reset(self) -> None:
+        """Clears the accumulated histogram (and its bins).
+        """
+        self._edges = None
+        self._counts = None
+        self.n_samples = 0
+        pass
+
+    def partial_fit(self,
+                    X: np.ndarray,
+                    Y: np.ndarray =None,
+                    weights: np.ndarray =None,
+                    bins: Union[int, np.ndarray] =None,
+                    range: (float, float) =None) -> 'FES':
+        """Accumulates the raw (weighted) counts of a chunk of data
+        on fixed bins, set by the first call from `bins` and `range`
+        (or from the bins edges). Samples out of the bins are dropped.
+
+        :param X: first CV, (n,).
+        :type X: np.ndarray
+        :param Y: second CV (2D FES), defaults to None
+        :type Y: np.ndarray, optional
+        :param weights: samples weights, defaults to None
+        :type weights: np.ndarray, optional
+        :param bins: number of bins or edges (one for all or one per CV), only on the first call, defaults to None
+        :type bins: Union[int, list, np.ndarray], optional
+        :param range: bins range, (min, max) or one per CV, defaults to None
+        :type range: float, float, optional
+        :raises ValueError: if the bins are not defined or the CVs number changes.
+        :return: the accumulator itself.
+        :rtype: FES
+        """
+        sample = [X] if Y is None else [X, Y]
+        if self._edges is None:
+            self._edges = _fixed_edges(bins=bins, range=range, dim=len(sample))
+            self._counts = np.zeros([len(e) - 1 for e in self._edges])
+        elif len(sample) != len(self._edges):
+            raise ValueError(f"The accumulator has {len(self._edges)} CVs, "
+                             f"{len(sample)} given.")
+        counts, _ = np.histogramdd(np.column_stack(sample), bins=self._edges,
+                                   weights=weights)
+        self._counts += counts
+        self.n_samples += len(X)
+        return self
+
+    def merge(self,
+              other: 'FES') -> 'FES':
+        """Adds the counts accumulated by another FES (e.g., another
+        walker or replica, or a separate process).
+
+        :param other: accumulator on the same bins.
+        :type other: FES
+        :raises ValueError: if the bins are different.
+        :return: the accumulator itself.
+        :rtype: FES
+        """
+        if other._edges is None:
+            return self
+        if self._edges is None:
+            self._edges = other._edges
+            self._counts = np.zeros_like(other._counts)
+        elif len(self._edges) != len(other._edges) or \
+             not all(np.array_equal(a, b) for a, b in zip(self._edges, other._edges)):
+            raise ValueError("Cannot merge FES with different bins.")
+        self._counts += other._counts
+        self.n_samples += other.n_samples
+        return self
+
+    def to_fes(self,
+               zero_level: Union[str, float] ='min',
+               fill_empty=True) -> dict:
+        """Computes the FES of the accumulated counts, with the same
+        layout as `fit`.
+
+        :param zero_level: FES zero, defaults to 'min'
+        :type zero_level: Union[str, float], optional
+        :param fill_empty: fill the empty bins with the max value, defaults to True
+        :type fill_empty: bool, optional
+        :raises ValueError: if nothing has been accumulated.
+        :return: fes dictionary, `fes` and `grid`.
+        :rtype: dict
+        """
+        if self._edges is None or self._counts.sum() == 0:
+            raise ValueError("No samples accumulated, call `partial_fit` first.")
+        # density, as np.histogram(..., density=True)
+        volumes = np.ones_like(self._counts)
+        for axis, e in enumerate(self._edges):
+            shape = [1] * len(self._edges)
+            shape[axis] = -1
+            volumes = volumes * np.diff(e).reshape(shape)
+        hist = self._counts / self._counts.sum() / volumes
+        zeta = histo_to_fes(histo=hist, kbt=self.kbT,
+                            zero_level=zero_level,
+                            fill_empty=fill_empty)
+        if len(self._edges) == 1:
+            grid = self._edges[0]
+        else:
+            xedges, yedges = self._edges
+            grid = mesh_grid_2d(X=xedges, Y=yedges, bins=len(xedges) - 1)
+        self.fes_dict = dict(
+            fes = zeta.T,
+            grid = grid
+        )
+        return self.fes_dict
+
     @misc.my_timer
     def fit(self,
             X: np.ndarray,
@@ -313,6 +549,297 @@ class FES(BaseFES):
         )
         return fes_dict
 
+    def fit_kde(self,
+                X: np.ndarray,
+                bins: int,
+                Y: np.ndarray =None,
+                range: (float, float) =None,
+                bandwidth: Union[str, float, tuple] ='scott',
+                zero_level: Union[str, float] ='min',
+                weights: np.ndarray =None,
+                fill_empty=True) -> dict:
+        """Computes the FES from a binned, FFT convolved, Gaussian KDE
+        (smoother than the raw histogram), with the same layout as `fit`.
+        `weights` can be used for reweighting (e.g., metadynamics bias).
+
+        :param X: first CV, (n,).
+        :type X: np.ndarray
+        :param bins: number of bins.
+        :type bins: int
+        :param Y: second CV (2D FES), defaults to None
+        :type Y: np.ndarray, optional
+        :param range: bins range, (min, max) or one per CV, defaults to None (data range)
+        :type range: float, float, optional
+        :param bandwidth: 'scott', 'silverman' or the kernel std (one or per CV), defaults to 'scott'
+        :type bandwidth: Union[str, float, tuple], optional
+        :param zero_level: FES zero, defaults to 'min'
+        :type zero_level: Union[str, float], optional
+        :param weights: samples weights, defaults to None
+        :type weights: np.ndarray, optional
+        :param fill_empty: fill the empty bins with the max value, defaults to True
+        :type fill_empty: bool, optional
+        :return: fes dictionary, `fes` and `grid`.
+        :rtype: dict
+        """
+        sample = np.column_stack([X] if Y is None else [X, Y]).astype(float)
+        dim = sample.shape[1]
+        ranges = [range] * dim if range is None or np.ndim(range) == 1 else list(range)
+        edges = [np.histogram_bin_edges(sample[:, cv], bins=bins, range=r)
+                 for cv, r in enumerate(ranges)]
+        if isinstance(bandwidth, str):
+            bandwidth = kde_bandwidth(sample, method=bandwidth, weights=weights)
+        else:
+            bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=float), (dim,))
+        hist = binned_kde(sample, edges=edges, bandwidth=bandwidth, weights=weights)
+        zeta = histo_to_fes(histo=hist, kbt=self.kbT,
+                            zero_level=zero_level,
+                            fill_empty=fill_empty)
+        if dim == 1:
+            grid = edges[0]
+        else:
+            grid = mesh_grid_2d(X=edges[0], Y=edges[1], bins=bins)
+        self.fes_dict = dict(
+            fes = zeta.T,
+            grid = grid
+        )
+        return self.fes_dict
+
+class SparseFES(BaseFES):
+    """N-dimensional FES on a sparse histogram: only the occupied bins
+    are stored, as sorted linear (raveled) bin indexes and their counts.
+    Counts are accumulated in chunks (`partial_fit`) and merged, the FES
+    is computed on the occupied bins only, and can be projected on any
+    CVs subset or exported as dense 1D/2D slices for `plots.fes`.
+
+    :param BaseFES: base class
+    :type BaseFES: class
+    """
+
+    def __init__(self,
+                 temperature: Union[int, float],
+                 units: str = 'kb'):
+        super().__init__(temperature, units)
+        self.reset()
+        pass
+
+    def reset(self) -> None:
+        """Clears the accumulated histogram (and its bins).
+        """
+        self.edges = None
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0)
+        self.n_samples = 0
+        pass
+
+    @property
+    def shape(self) -> tuple:
+        """Number of bins of each CV.
+
+        :return: dense histogram shape.
+        :rtype: tuple
+        """
+        return tuple(len(e) - 1 for e in self.edges)
+
+    @property
+    def n_occupied(self) -> int:
+        """Number of occupied bins.
+
+        :return: occupied bins.
+        :rtype: int
+        """
+        return len(self._keys)
+
+    def partial_fit(self,
+                    X: np.ndarray,
+                    weights: np.ndarray =None,
+                    bins: Union[int, list] =None,
+                    range: list =None) -> 'SparseFES':
+        """Accumulates the raw (weighted) counts of a chunk of data
+        on fixed bins, set by the first call from `bins` and `range`
+        (or from the bins edges). Samples out of the bins are dropped.
+
+        :param X: CVs, (n, d).
+        :type X: np.ndarray
+        :param weights: samples weights, defaults to None
+        :type weights: np.ndarray, optional
+        :param bins: number of bins or edges (one for all or one per CV), only on the first call, defaults to None
+        :type bins: Union[int, list], optional
+        :param range: bins range, (min, max) or one per CV, defaults to None
+        :type range: list, optional
+        :raises ValueError: if the bins are not defined or the CVs number changes.
+        :return: the accumulator itself.
+        :rtype: SparseFES
+        """
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        if self.edges is None:
+            self.edges = _fixed_edges(bins=bins, range=range, dim=X.shape[1])
+        elif X.shape[1] != len(self.edges):
+            raise ValueError(f"The accumulator has {len(self.edges)} CVs, "
+                             f"{X.shape[1]} given.")
+        index, inside = _bin_index(X, self.edges)
+        keys = np.ravel_multi_index(index.T, self.shape)
+        w = None if weights is None else np.asarray(weights, dtype=float)[inside]
+        self._add(keys, np.ones(len(keys)) if w is None else w)
+        self.n_samples += len(X)
+        return self
+
+    def _add(self,
+             keys: np.ndarray,
+             counts: np.ndarray) -> None:
+        """Sums counts into the sorted keys.
+        """
+        keys = np.concatenate([self._keys, keys])
+        counts = np.concatenate([self._counts, counts])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse.ravel(), weights=counts,
+                                   minlength=len(self._keys))
+        pass
+
+    def merge(self,
+              other: 'SparseFES') -> 'SparseFES':
+        """Adds the counts accumulated by another SparseFES.
+
+        :param other: accumulator on the same bins.
+        :type other: SparseFES
+        :raises ValueError: if the bins are different.
+        :return: the accumulator itself.
+        :rtype: SparseFES
+        """
+        if other.edges is None:
+            return self
+        if self.edges is None:
+            self.edges = other.edges
+        elif len(self.edges) != len(other.edges) or \
+             not all(np.array_equal(a, b) for a, b in zip(self.edges, other.edges)):
+            raise ValueError("Cannot merge FES with different bins.")
+        self._add(other._keys, other._counts)
+        self.n_samples += other.n_samples
+        return self
+
+    @property
+    def index(self) -> np.ndarray:
+        """Bins indexes of the occupied bins.
+
+        :return: indexes, (n_occupied, d).
+        :rtype: np.ndarray
+        """
+        return np.column_stack(np.unravel_index(self._keys, self.shape))
+
+    def marginalize(self,
+                    cvs: List[int]) -> 'SparseFES':
+        """Projects the histogram on a subset of CVs (summing
+        the counts over the others).
+
+        :param cvs: CVs to keep.
+        :type cvs: List[int]
+        :return: histogram on the CVs subset.
+        :rtype: SparseFES
+        """
+        marginal = SparseFES(self.temp, self.unit)
+        marginal.edges = [self.edges[cv] for cv in cvs]
+        keys = np.ravel_multi_index(self.index[:, list(cvs)].T, marginal.shape)
+        marginal._add(keys, self._counts)
+        marginal.n_samples = self.n_samples
+        return marginal
+
+    def _density(self) -> np.ndarray:
+        """Density of the occupied bins, as np.histogramdd(..., density=True).
+        """
+        if not self.n_occupied:
+            raise ValueError("No samples accumulated, call `partial_fit` first.")
+        index = self.index
+        volumes = np.ones(self.n_occupied)
+        for cv, e in enumerate(self.edges):
+            volumes *= np.diff(e)[index[:, cv]]
+        return self._counts / self._counts.sum() / volumes
+
+    def to_fes(self,
+               zero_level: Union[str, float] ='min') -> dict:
+        """Computes the FES on the occupied bins only.
+
+        :param zero_level: FES zero, defaults to 'min'
+        :type zero_level: Union[str, float], optional
+        :return: dictionary with `fes` (n_occupied,), the bins `index` (n_occupied, d),
+            the bins `centers` (n_occupied, d) and the `edges`.
+        :rtype: dict
+        """
+        zeta = histo_to_fes(histo=self._density(), kbt=self.kbT,
+                            zero_level=zero_level, fill_empty=False)
+        index = self.index
+        centers = np.column_stack([0.5 * (e[1:] + e[:-1])[index[:, cv]]
+                                   for cv, e in enumerate(self.edges)])
+        return dict(
+            fes = zeta,
+            index = index,
+            centers = centers,
+            edges = self.edges
+        )
+
+    def to_dense(self,
+                 cvs: List[int],
+                 fixed: dict =None,
+                 zero_level: Union[str, float] ='min',
+                 fill_empty=True) -> dict:
+        """Dense 1D or 2D FES on `cvs`, in the `FES.fit` layout
+        (for `plot_fes_1d` / `plot_fes_2d`). The other CVs are
+        marginalized, or sliced at the bins given in `fixed`.
+
+        :param cvs: one or two CVs.
+        :type cvs: List[int]
+        :param fixed: CV: bin index of the slice, defaults to None (marginalize all)
+        :type fixed: dict, optional
+        :param zero_level: FES zero, defaults to 'min'
+        :type zero_level: Union[str, float], optional
+        :param fill_empty: fill the empty bins with the max value, defaults to True
+        :type fill_empty: bool, optional
+        :raises ValueError: if more than two CVs are asked.
+        :return: fes dictionary, `fes` and `grid`.
+        :rtype: dict
+        """
+        if len(cvs) not in (1, 2):
+            raise ValueError("Dense FES exports are 1D or 2D.")
+        sliced = self
+        if fixed:
+            mask = np.ones(self.n_occupied, dtype=bool)
+            index = self.index
+            for cv, b in fixed.items():
+                mask &= index[:, cv] == b
+            sliced = SparseFES(self.temp, self.unit)
+            sliced.edges = self.edges
+            sliced._keys, sliced._counts = self._keys[mask], self._counts[mask]
+        marginal = sliced.marginalize(cvs)
+        hist = np.zeros(marginal.shape)
+        hist[tuple(marginal.index.T)] = marginal._density()
+        zeta = histo_to_fes(histo=hist, kbt=self.kbT,
+                            zero_level=zero_level,
+                            fill_empty=fill_empty)
+        if len(cvs) == 1:
+            grid = marginal.edges[0]
+        else:
+            xedges, yedges = marginal.edges
+            grid = mesh_grid_2d(X=xedges, Y=yedges, bins=len(xedges) - 1)
+        return dict(
+            fes = zeta.T,
+            grid = grid
+        )
+
+
+def _bin_index(X: np.ndarray,
+               edges: list) -> (np.ndarray, np.ndarray):
+    """Bin index of each sample along each CV (the last edge is
+    included, as np.histogramdd) and the in range samples mask.
+    """
+    index = np.empty(X.shape, dtype=np.int64)
+    inside = np.ones(len(X), dtype=bool)
+    for cv, e in enumerate(edges):
+        i = np.searchsorted(e, X[:, cv], side='right') - 1
+        i[X[:, cv] == e[-1]] = len(e) - 2
+        inside &= (i >= 0) & (i < len(e) - 1)
+        index[:, cv] = i
+    return index[inside], inside
+
 # -------------------------------------------------- #
 # --- Plot
 
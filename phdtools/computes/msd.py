@@ -0,0 +1,135 @@
+# -------------------------------------------------- #
+# Computes - mean squared displacement module
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import numpy as np
+from typing import Union, Tuple
+from phdtools.computes.correlation import correlation_fft
+
+# -------------------------------------------------- #
+# --- MSD
+
+def msd_fft(X: np.ndarray) -> np.ndarray:
+    """All time origins MSD of each particle, with the FFT algorithm:
+    MSD(m) = S1(m) - 2 S2(m), where S2 is the positions autocorrelation
+    and S1 is computed with cumulative sums, O(T log T).
+
+    :param X: unwrapped positions, (T, N, d) or (T, d).
+    :type X: np.ndarray
+    :return: MSD per particle, (T, N) or (T,).
+    :rtype: np.ndarray
+    """
+    X = np.asarray(X, dtype=float)
+    T = len(X)
+    D = np.sum(X ** 2, axis=-1)
+    # sums of D over the first m and the last m frames
+    zero = np.zeros((1,) + D.shape[1:])
+    head = np.concatenate([zero, np.cumsum(D, axis=0)])[:T]
+    tail = np.concatenate([zero, np.cumsum(D[::-1], axis=0)])[:T]
+    norm = (T - np.arange(T)).reshape((T,) + (1,) * (D.ndim - 1))
+    S1 = (2 * np.sum(D, axis=0) - head - tail) / norm
+    S2 = np.sum(correlation_fft(X), axis=-1)
+    return S1 - 2 * S2
+
+
+def stack_unwrapped(unwrap_coord_dict: dict) -> Tuple[np.ndarray, list]:
+    """Stacks the `ase_mol_unwrap` output into a single array.
+
+    :param unwrap_coord_dict: molecule symbol: list of (T, 3) unwrapped coordinates.
+    :type unwrap_coord_dict: dict
+    :return: unwrapped positions (T, N, 3) and the molecule symbol of each particle.
+    :rtype: Tuple[np.ndarray, list]
+    """
+    X = list()
+    molSym = list()
+    for mol, coords in unwrap_coord_dict.items():
+        X.extend(coords)
+        molSym.extend([mol] * len(coords))
+    return np.stack(X, axis=1), molSym
+
+
+class MSD:
+    """Mean squared displacement and self-diffusion coefficients,
+    per molecule type, from unwrapped trajectories.
+    """
+
+    def __init__(self,
+                 dt: float = 1.0):
+        """
+        :param dt: time between frames, defaults to 1.0
+        :type dt: float, optional
+        """
+        self.dt = dt
+        self.msd_dict = None
+        self._X = None
+        self._molSym = None
+        pass
+
+    def fit(self,
+            X: Union[np.ndarray, dict],
+            molSym: list = None) -> dict:
+        """Computes the all time origins MSD, averaged per molecule type.
+
+        :param X: unwrapped positions (T, N, d), or the `ase_mol_unwrap` dictionary.
+        :type X: Union[np.ndarray, dict]
+        :param molSym: molecule symbol of each particle, defaults to None (single group)
+        :type molSym: list, optional
+        :return: dictionary with `time` and the MSD of each group.
+        :rtype: dict
+        """
+        if isinstance(X, dict):
+            X, molSym = stack_unwrapped(X)
+        X = np.asarray(X, dtype=float)
+        if molSym is None:
+            molSym = ['all'] * X.shape[1]
+        self._X, self._molSym = X, np.asarray(molSym)
+        self.msd_dict = self._group_msd(X)
+        return self.msd_dict
+
+    def _group_msd(self,
+                   X: np.ndarray) -> dict:
+        msd = msd_fft(X)
+        msd_dict = dict(time = np.arange(len(X)) * self.dt)
+        for mol in np.unique(self._molSym):
+            msd_dict[str(mol)] = msd[:, self._molSym == mol].mean(axis=1)
+        return msd_dict
+
+    def diffusion(self,
+                  fit_range: Tuple[float, float],
+                  n_blocks: int = 5) -> dict:
+        """Self-diffusion coefficients from the slope of the MSD,
+        D = slope / (2 d), block averaged: the trajectory is split in
+        `n_blocks` windows, each fitted on its own.
+
+        :param fit_range: (begin, end) times of the linear fit.
+        :type fit_range: Tuple[float, float]
+        :param n_blocks: number of windows, defaults to 5
+        :type n_blocks: int, optional
+        :raises ValueError: if `fit` has not been called or the windows are too short.
+        :return: molecule symbol: (D mean, D standard error) dictionary.
+        :rtype: dict
+        """
+        if self._X is None:
+            raise ValueError("Call `fit` before `diffusion`.")
+        dim = self._X.shape[-1]
+        block_len = len(self._X) // n_blocks
+        time = np.arange(block_len) * self.dt
+        fit_mask = (time >= fit_range[0]) & (time <= fit_range[1])
+        if fit_mask.sum() < 2:
+            raise ValueError("The fit range has less than 2 points in each window.")
+        D_blocks = {str(mol): list() for mol in np.unique(self._molSym)}
+        for b in range(n_blocks):
+            block = self._X[b * block_len:(b + 1) * block_len]
+            block_msd = self._group_msd(block)
+            for mol in D_blocks:
+                slope = np.polyfit(time[fit_mask], block_msd[mol][fit_mask], 1)[0]
+                D_blocks[mol].append(slope / (2 * dim))
+        diffusion_dict = dict()
+        for mol, D in D_blocks.items():
+            D = np.array(D)
+            err = D.std(ddof=1) / np.sqrt(len(D)) if len(D) > 1 else np.nan
+            diffusion_dict[mol] = (D.mean(), err)
+        return diffusion_dict
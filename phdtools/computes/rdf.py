@@ -0,0 +1,279 @@
+# -------------------------------------------------- #
+# Computes - radial distribution function module
+#
+#
+# AUTHOR: Andrea Gardin
+# -------------------------------------------------- #
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# -------------------------------------------------- #
+# --- RDF
+
+class RDF:
+    """Periodic radial distribution function g(r) accumulator.
+    Frames can be added in batches (`partial_fit`) and accumulators built
+    on different frames (e.g., in separate processes) can be merged.
+    Each frame is normalized by its own volume, so NPT runs are fine.
+    """
+
+    def __init__(self,
+                 r_max: float,
+                 bins: int = 200,
+                 r_min: float = 0.0):
+        """
+        :param r_max: largest distance.
+        :type r_max: float
+        :param bins: number of bins, defaults to 200
+        :type bins: int, optional
+        :param r_min: smallest distance, defaults to 0.0
+        :type r_min: float, optional
+        """
+        self.edges = np.linspace(r_min, r_max, bins + 1)
+        self.reset()
+        pass
+
+    @property
+    def r_max(self) -> float:
+        """Largest distance.
+
+        :return: r_max.
+        :rtype: float
+        """
+        return self.edges[-1]
+
+    @property
+    def r(self) -> np.ndarray:
+        """Bins centers.
+
+        :return: distances, (bins,).
+        :rtype: np.ndarray
+        """
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    def reset(self) -> None:
+        """Clears the accumulated frames.
+        """
+        self._hist = np.zeros(len(self.edges) - 1)
+        self.n_frames = 0
+        pass
+
+    def partial_fit(self,
+                    A: np.ndarray,
+                    cells: np.ndarray,
+                    B: np.ndarray = None) -> 'RDF':
+        """Accumulates a batch of frames.
+
+        :param A: positions of the first species, (Na, 3) or (T, Na, 3).
+        :type A: np.ndarray
+        :param cells: cells, (3, 3) or (T, 3, 3) (rows are the cell vectors).
+        :type cells: np.ndarray
+        :param B: positions of the second species, defaults to None (B = A)
+        :type B: np.ndarray, optional
+        :raises ValueError: if a selection is empty, or has a single particle with B = A.
+        :return: the accumulator itself.
+        :rtype: RDF
+        """
+        A = np.asarray(A, dtype=float)
+        if A.ndim == 2:
+            A = A[np.newaxis]
+        cells = np.asarray(cells, dtype=float).reshape(-1, 3, 3)
+        if len(cells) == 1 and len(A) > 1:
+            cells = np.repeat(cells, len(A), axis=0)
+        if B is not None:
+            B = np.asarray(B, dtype=float)
+            if B.ndim == 2:
+                B = B[np.newaxis]
+        n_a = A.shape[1]
+        n_b = n_a - 1 if B is None else B.shape[1]
+        if n_a * n_b == 0:
+            raise ValueError(f"No pairs in the selections ({n_a} and "
+                             f"{n_a if B is None else n_b} particles).")
+        for t in range(len(A)):
+            b = None if B is None else B[t]
+            d = pbc_pair_distances(A[t], cells[t], self.r_max, B=b)
+            counts, _ = np.histogram(d, bins=self.edges)
+            # ordered pairs density of the frame
+            self._hist += counts * abs(np.linalg.det(cells[t])) / (n_a * n_b)
+            self.n_frames += 1
+        return self
+
+    def merge(self,
+              other: 'RDF') -> 'RDF':
+        """Adds the frames accumulated by another RDF.
+
+        :param other: accumulator on the same bins.
+        :type other: RDF
+        :raises ValueError: if the bins are different.
+        :return: the accumulator itself.
+        :rtype: RDF
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge RDFs with different bins.")
+        self._hist += other._hist
+        self.n_frames += other.n_frames
+        return self
+
+    def fit(self,
+            A: np.ndarray,
+            cells: np.ndarray,
+            B: np.ndarray = None) -> dict:
+        """Computes the g(r) of a set of frames.
+
+        :param A: positions of the first species, (Na, 3) or (T, Na, 3).
+        :type A: np.ndarray
+        :param cells: cells, (3, 3) or (T, 3, 3).
+        :type cells: np.ndarray
+        :param B: positions of the second species, defaults to None (B = A)
+        :type B: np.ndarray, optional
+        :return: rdf dictionary, see `rdf_dict`.
+        :rtype: dict
+        """
+        self.reset()
+        self.partial_fit(A=A, cells=cells, B=B)
+        return self.rdf_dict
+
+    @property
+    def rdf_dict(self) -> dict:
+        """g(r) of the accumulated frames.
+
+        :return: dictionary with `r` (bins centers), `g` and `edges`.
+        :rtype: dict
+        """
+        shell = 4. / 3. * np.pi * np.diff(self.edges ** 3)
+        g = self._hist / (max(self.n_frames, 1) * shell)
+        return dict(
+            r = self.r,
+            g = g,
+            edges = self.edges
+        )
+
+# -------------------------------------------------- #
+# --- Pairs search
+
+def pbc_pair_distances(A: np.ndarray,
+                       cell: np.ndarray,
+                       r_max: float,
+                       B: np.ndarray = None) -> np.ndarray:
+    """Periodic distances below r_max between the A and B positions,
+    as ordered pairs (with B = A each pair is counted twice, self excluded).
+    Orthorhombic cells with r_max below half the box use a periodic
+    cKDTree, otherwise (triclinic cells) the B periodic images are added.
+
+    :param A: positions, (Na, 3).
+    :type A: np.ndarray
+    :param cell: cell, (3, 3) (rows are the cell vectors).
+    :type cell: np.ndarray
+    :param r_max: largest distance.
+    :type r_max: float
+    :param B: positions, defaults to None (B = A)
+    :type B: np.ndarray, optional
+    :raises ValueError: if r_max is larger than the cell width.
+    :return: distances, (n_pairs,).
+    :rtype: np.ndarray
+    """
+    box = np.diagonal(cell)
+    if np.allclose(cell, np.diag(box)) and r_max < box.min() / 2:
+        A = wrap_box(A, box)
+        treeA = cKDTree(A, boxsize=box)
+        if B is None:
+            pairs = treeA.query_pairs(r=r_max, output_type='ndarray')
+            d = minimum_image_box(A[pairs[:, 1]] - A[pairs[:, 0]], box)
+            d = np.linalg.norm(d, axis=1)
+            return np.concatenate([d, d])
+        treeB = cKDTree(wrap_box(B, box), boxsize=box)
+        return treeA.sparse_distance_matrix(treeB, r_max,
+                                            output_type='ndarray')['v']
+    # triclinic (or large r_max): explicit periodic images of B
+    volume = abs(np.linalg.det(cell))
+    widths = volume / np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+    if r_max > widths.min():
+        raise ValueError(f"r_max={r_max} larger than the cell width {widths.min():.3f}.")
+    frac = np.linalg.solve(cell.T, A.T).T
+    A = (frac - np.floor(frac)) @ cell
+    same = B is None
+    if same:
+        B = A
+    else:
+        frac = np.linalg.solve(cell.T, B.T).T
+        B = (frac - np.floor(frac)) @ cell
+    shifts = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1],
+                                  indexing='ij')).reshape(3, -1).T
+    images = (B[np.newaxis] + (shifts @ cell)[:, np.newaxis]).reshape(-1, 3)
+    sdm = cKDTree(A).sparse_distance_matrix(cKDTree(images), r_max,
+                                            output_type='ndarray')
+    if same:
+        # drop each atom with itself in the central image
+        central = np.flatnonzero(np.all(shifts == 0, axis=1))[0]
+        self_pair = sdm['j'] == central * len(B) + sdm['i']
+        return sdm['v'][~self_pair]
+    return sdm['v']
+
+
+# -------------------------------------------------- #
+# --- Orthorhombic boxes
+
+def wrap_box(X: np.ndarray,
+             box: np.ndarray) -> np.ndarray:
+    """Wraps positions into an orthorhombic box, [0, L).
+
+    :param X: positions, (..., 3).
+    :type X: np.ndarray
+    :param box: box lengths, (3,).
+    :type box: np.ndarray
+    :return: wrapped positions (a new array).
+    :rtype: np.ndarray
+    """
+    X = np.mod(X, box)
+    # np.mod can round up to the box edge
+    X[X >= box] = 0.0
+    return X
+
+
+def minimum_image_box(d: np.ndarray,
+                      box: np.ndarray) -> np.ndarray:
+    """Minimum image convention of displacements in an orthorhombic box.
+
+    :param d: displacements, (..., 3).
+    :type d: np.ndarray
+    :param box: box lengths, (3,).
+    :type box: np.ndarray
+    :return: minimum image displacements (a new array).
+    :rtype: np.ndarray
+    """
+    return d - np.round(d / box) * box
+
+# -------------------------------------------------- #
+# --- Triclinic cells
+
+def wrap_positions(positions: np.ndarray,
+                   cells: np.ndarray) -> np.ndarray:
+    """Wraps positions into the (triclinic) cell, through the
+    fractional coordinates and `wrap_box` on the unit box.
+
+    :param positions: positions, (T, n, 3).
+    :type positions: np.ndarray
+    :param cells: cells, (T, 3, 3) (rows are the cell vectors).
+    :type cells: np.ndarray
+    :return: wrapped positions, (T, n, 3).
+    :rtype: np.ndarray
+    """
+    frac = np.einsum('tni,tij->tnj', positions, np.linalg.inv(cells))
+    return np.einsum('tni,tij->tnj', wrap_box(frac, np.ones(3)), cells)
+
+
+def minimum_image(d: np.ndarray,
+                  cells: np.ndarray) -> np.ndarray:
+    """Minimum image convention of displacements, for any (triclinic) cell,
+    through the fractional coordinates and `minimum_image_box` on the unit box.
+
+    :param d: displacements, (T, n, 3).
+    :type d: np.ndarray
+    :param cells: cells, (T, 3, 3) (rows are the cell vectors).
+    :type cells: np.ndarray
+    :return: minimum image displacements, (T, n, 3).
+    :rtype: np.ndarray
+    """
+    frac = np.einsum('tni,tij->tnj', d, np.linalg.inv(cells))
+    return np.einsum('tni,tij->tnj', minimum_image_box(frac, np.ones(3)), cells)
@@ -7,6 +7,7 @@
 
 import numpy as np
 from tqdm import tqdm
+from typing import Union
 
 # -------------------------------------------------- #
 # --- Coordinate unwrapper
@@ -21,6 +22,8 @@ class XYZunwrapper:
         except:
             raise NameError("Chosen method not available.\n"
                             f"Choose from {self._methods_dict.keys()}")
+        # carry-over state for the chunked (streaming) unwrapping
+        self.reset()
     pass
 
     @property
@@ -31,6 +34,15 @@ class XYZunwrapper:
             hybrid = hybrid_unwrapping,
         )
         return methods_function_dict
+
+    @property
+    def _block_methods_dict(self):
+        methods_function_dict = {
+            heuristic_unwrapping : heuristic_unwrapping_block,
+            displacement_unwrapping : displacement_unwrapping_block,
+            hybrid_unwrapping : hybrid_unwrapping_block,
+        }
+        return methods_function_dict
     
     @property
     def method(self):
@@ -59,22 +71,165 @@ class XYZunwrapper:
 
     def fit(self, 
             xyz: np.ndarray, 
-            box: list) -> np.ndarray:
+            box: Union[list, np.ndarray]) -> np.ndarray:
         """Applies the unwrapping mehtod chosen to a XYZ trajectory.
+        The trajectory can be a single particle (T, 3) or a block
+        of particles (T, N, 3), unwrapped all at once.
+
+        :param xyz: xyz coordinates trajectory, (T, 3) or (T, N, 3).
+        :type xyz: np.ndarray
+        :param box: extent of the simulation box, per frame (T,) or (T, 3).
+        :type box: Union[list, np.ndarray]
+        :return: unwrapped coordinates trajectory, same shape of `xyz`.
+        :rtype: np.ndarray
+        """
+        w = np.asarray(xyz, dtype=float)
+        single = w.ndim == 2
+        if single:
+            w = w[:, np.newaxis, :]
+        u = self._block_methods_dict[self._method](w=w,
+                                                   box=box_to_array(box, len(w)))
+        if single:
+            return u[:, 0, :]
+        return u
+
 
-        :param xyz: xyz coordinates trajectory.
+    def partial_fit(self,
+                    xyz: np.ndarray,
+                    box: Union[list, np.ndarray]) -> np.ndarray:
+        """Unwraps a chunk of consecutive frames, carrying over the last
+        wrapped and unwrapped positions and box from the previous chunk.
+        Feeding a trajectory chunk by chunk gives the same output of a
+        single `fit` call, independently of the chunking.
+        Use `reset` before starting a new trajectory.
+
+        :param xyz: xyz coordinates chunk, (t, 3) or (t, N, 3).
         :type xyz: np.ndarray
-        :param box: extent of the simulation box.
-        :type box: list
-        :return: unwrapped coordinates trajectory.
+        :param box: extent of the simulation box, per frame (t,) or (t, 3).
+        :type box: Union[list, np.ndarray]
+        :raises ValueError: if the number of particles changes between chunks.
+        :return: unwrapped coordinates chunk, same shape of `xyz`.
         :rtype: np.ndarray
         """
-        return self._method(w=xyz, 
-                            box=box)
+        w = np.asarray(xyz, dtype=float)
+        single = w.ndim == 2
+        if single:
+            w = w[:, np.newaxis, :]
+        if len(w) == 0:
+            return np.asarray(xyz, dtype=float)
+        box = box_to_array(box, len(w))
+        if self._last_w is None:
+            u = self._block_methods_dict[self._method](w=w, box=box)
+        else:
+            if self._last_w.shape != w.shape[1:]:
+                raise ValueError("Number of particles changed between chunks: "
+                                 f"{self._last_w.shape[0]} -> {w.shape[1]}.")
+            # the last frame of the previous chunk is the starting point
+            w = np.concatenate([self._last_w[np.newaxis], w])
+            box = np.concatenate([self._last_box[np.newaxis], box])
+            u = self._block_methods_dict[self._method](w=w, box=box,
+                                                       u0=self._last_u)
+            w, box, u = w[1:], box[1:], u[1:]
+        self._last_w = w[-1].copy()
+        self._last_u = u[-1].copy()
+        self._last_box = box[-1].copy()
+        if single:
+            return u[:, 0, :]
+        return u
+
+
+    def reset(self) -> None:
+        """Clears the carry-over state of the chunked unwrapping.
+        """
+        self._last_w = None
+        self._last_u = None
+        self._last_box = None
+        pass
 
 # -------------------------------------------------- #
 
-# -- Unwrap functions
+def box_to_array(box: Union[float, list, np.ndarray],
+                 n_frames: int) -> np.ndarray:
+    """Converts the box extent to a (T, 1, 3) array, broadcastable
+    against a (T, N, 3) block of coordinates.
+
+    :param box: box extent, scalar, per axis (3,), per frame (T,) or (T, 1),
+        or per frame and axis (T, 3).
+    :type box: Union[float, list, np.ndarray]
+    :param n_frames: number of frames T.
+    :type n_frames: int
+    :raises ValueError: if the box shape is not compatible with the frames,
+        or is ambiguous (a 1D box of length 3 with 3 frames).
+    :return: box array of shape (T, 1, 3).
+    :rtype: np.ndarray
+    """
+    box = np.asarray(box, dtype=float)
+    if box.ndim == 1 and len(box) == 3 and n_frames == 3:
+        raise ValueError("Ambiguous box of shape (3,) for 3 frames: pass "
+                         "(3, 3) for per axis or (3, 1) for per frame values.")
+    if box.ndim == 0:
+        box = np.full((n_frames, 3), box)
+    elif box.ndim == 1 and len(box) == n_frames:
+        box = np.repeat(box[:, np.newaxis], 3, axis=1)
+    elif box.ndim == 1 and len(box) == 3:
+        box = np.tile(box, (n_frames, 1))
+    elif box.shape == (n_frames, 1):
+        box = np.repeat(box, 3, axis=1)
+    if box.shape != (n_frames, 3):
+        raise ValueError(f"Box shape {box.shape} not compatible with "
+                         f"{n_frames} frames.")
+    return box[:, np.newaxis, :]
+
+# -- Unwrap functions (block, all particles at once)
+def heuristic_unwrapping_block(w: np.ndarray,
+                               box: np.ndarray,
+                               u0: np.ndarray = None) -> np.ndarray:
+    """Heuristic unwrapping (block).
+
+    The recursion depends on the previous unwrapped frame, hence it
+    loops over the frames while being vectorized over the particles.
+    """
+    u = np.empty_like(w)
+    u[0] = w[0] if u0 is None else u0
+    # Eq. 1 Heuristic method
+    for i in range(1, len(w)):
+        u[i] = w[i]-np.floor((w[i]-u[i-1])/box[i]+0.5)*box[i]
+    return u
+
+
+def displacement_unwrapping_block(w: np.ndarray,
+                                  box: np.ndarray,
+                                  u0: np.ndarray = None) -> np.ndarray:
+    """Displacement unwrapping (block).
+
+    """
+    u = np.empty_like(w)
+    u[0] = w[0] if u0 is None else u0
+    # Eq 2. Displacemnet method, as cumulative sum of the
+    # minimum image displacements
+    difw = np.diff(w, axis=0)
+    u[1:] = difw-np.floor(difw/box[1:]+0.5)*box[1:]
+    return np.cumsum(u, axis=0, out=u)
+
+
+def hybrid_unwrapping_block(w: np.ndarray,
+                            box: np.ndarray,
+                            u0: np.ndarray = None) -> np.ndarray:
+    """Hybrid unwrapping (block).
+
+    Eq. 12 keeps u[i] = w[i] - m[i]*box[i] with m[i] integer image
+    counters, where m[i+1] = m[i] + floor((w[i+1]-w[i])/box[i+1]+0.5).
+    The counters are then a cumulative sum of the image jumps.
+    """
+    difw = np.diff(w, axis=0)
+    m = np.zeros_like(w)
+    if u0 is not None:
+        m[0] = np.rint((w[0]-u0)/box[0])
+    m[1:] = np.floor(difw/box[1:]+0.5)
+    np.cumsum(m, axis=0, out=m)
+    return w-m*box
+
+# -- Unwrap functions (reference, single particle)
 def heuristic_unwrapping(w: np.ndarray,
                          box: list) -> np.ndarray:
     """Heuristic unwrapping.
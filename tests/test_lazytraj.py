@@ -0,0 +1,37 @@
+import numpy as np
+import ase.io
+
+from phdtools.ASEtools.lazytraj import LazyTraj, scan_frames
+
+
+FRAME = """2
+Lattice="10.0 0.0 0.0 0.0 10.0 0.0 0.0 0.0 10.0" Properties=species:S:1:pos:R:3 pbc="T T T"
+O {x:.1f} 0.0 0.0
+H {x:.1f} 1.0 0.0
+"""
+
+
+def _write(path, n_frames, final_newline=True):
+    text = ''.join(FRAME.format(x=float(t)) for t in range(n_frames))
+    if not final_newline:
+        text = text.rstrip('\n')
+    path.write_text(text)
+    return str(path)
+
+
+def test_scan_frames_without_final_newline(tmp_path):
+    trajPath = _write(tmp_path / 'traj.xyz', 3, final_newline=False)
+    index = scan_frames(trajPath)
+    assert len(index['natoms']) == 3
+    ref = ase.io.read(trajPath, index=':')
+    lazy = LazyTraj(trajPath, cache=False)
+    assert len(lazy) == len(ref)
+    for a, b in zip(lazy, ref):
+        np.testing.assert_allclose(a.positions, b.positions)
+
+
+def test_scan_frames_truncated_last_frame(tmp_path):
+    trajPath = _write(tmp_path / 'traj.xyz', 3)
+    with open(trajPath, 'a') as f:
+        f.write("2\ncomment\nO 0.0 0.0 0.0\n")
+    assert len(scan_frames(trajPath)['natoms']) == 3